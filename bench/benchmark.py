@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# Runs the report pipelines against replayed fixtures and a local S3
+# stand-in, reporting wall time, API requests, bytes received, peak RSS and
+# bytes uploaded per stage.
+#
+#   python3 bench/benchmark.py /tmp/fixtures --checks 10000 \
+#       --pagerduty-incidents 50000 --statuspage-incidents 5000
+#
+# Fixtures are generated on the first run if FIXTURES doesn't exist yet.
+# Each pipeline runs in its own process, since every report imports its own
+# top level `settings` module (the combined pipeline loads each report's
+# settings separately). Stage timings are inclusive: a stage that
+# calls another (e.g. generate_report -> get_incidents) includes its time,
+# and rows are generated as write_report consumes them.
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BENCH = os.path.join(ROOT, 'bench')
+COMMON = os.path.join(ROOT, 'common')
+
+PIPELINES = {
+    'pingdom': ['write_report', 'upload_reports'],
+    'incident': ['get_incidents', 'get_log_entry_indexes', 'get_users_timezones',
+                 'generate_report', 'write_report'],
+    'slo': ['get_components', 'get_incidents', 'find_downtimes_by_day', 'write_report'],
+    # the same three in one process (combined_report.py), timed per source
+    'combined': ['pingdom', 'incident', 'slo'],
+}
+
+
+def server_stats(server_url):
+    with urllib.request.urlopen(server_url + '/__stats') as resp:
+        stats = json.load(resp)
+    return sum(stats['requests'].values()), sum(stats['bytes'].values())
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_uploaded = 0
+        self.peak_rss_mb = 0.0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def instrument(module, name, stage, server_url):
+    func = getattr(module, name)
+
+    def record(started, before):
+        requests, received = server_stats(server_url)
+        stage.calls += 1
+        stage.seconds += time.perf_counter() - started
+        stage.requests += requests - before[0]
+        stage.bytes_received += received - before[1]
+        stage.peak_rss_mb = peak_rss_mb()
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            before, started = server_stats(server_url), time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record(started, before)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            before, started = server_stats(server_url), time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(started, before)
+    setattr(module, name, wrapper)
+
+
+class TimedS3Client:
+    # wraps LocalS3Client so uploads show up as their own stage
+    def __init__(self, client, stage):
+        self.client = client
+        self.stage = stage
+
+    def upload_file(self, *args, **kwargs):
+        started = time.perf_counter()
+        before = self.client.bytes_uploaded
+        self.client.upload_file(*args, **kwargs)
+        self.stage.calls += 1
+        self.stage.seconds += time.perf_counter() - started
+        self.stage.bytes_uploaded += self.client.bytes_uploaded - before
+        self.stage.peak_rss_mb = peak_rss_mb()
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def point_at_replay(name, module, settings, server_url, window_days):
+    if name == 'pingdom':
+        module.BASE_URL = server_url + '/pingdom'
+        settings.DAYS_BACK = window_days
+        settings.OUTPUT_PATH = os.path.join(os.getcwd(), 'pingdom_report')
+    elif name == 'incident':
+        module.BASE_URL = server_url + '/pagerduty'
+        settings.DAYS_BACK = window_days
+    elif name == 'slo':
+        module.BASE_URL = server_url + '/statuspage'
+        settings.DAYS = window_days
+
+
+def run_pipeline(name, server_url, s3_path, window_days):
+    sys.path[:0] = [os.path.join(ROOT, name), COMMON, BENCH]
+    import settings
+    from replay import LocalS3Client
+    from uploader import S3Uploader
+
+    module = __import__('%s_report' % name)
+    upload = Stage('s3 upload')
+    client = TimedS3Client(LocalS3Client(s3_path), upload)
+    if name == 'combined':
+        # every source in one process, each timed as a whole
+        module.get_s3_client = lambda: client
+        stages = [Stage(source) for source in PIPELINES[name]]
+        for stage in stages:
+            source = module.SOURCES[stage.name]
+            source.load()
+            point_at_replay(source.name, source.module, source.module.settings,
+                            server_url, window_days)
+            instrument(source, 'run', stage, server_url)
+    else:
+        stages = [Stage(stage) for stage in PIPELINES[name]]
+        for stage in stages:
+            instrument(module, stage.name, stage, server_url)
+        module.S3Uploader = functools.partial(S3Uploader, client=client)
+        point_at_replay(name, module, settings, server_url, window_days)
+
+    started = time.perf_counter()
+    if name in ('pingdom', 'combined'):
+        event = {'sources': PIPELINES[name]} if name == 'combined' else None
+        asyncio.get_event_loop().run_until_complete(module.main(event))
+    else:
+        module.lambda_handler(None, None)
+    total = Stage('total')
+    total.seconds = time.perf_counter() - started
+    total.requests, total.bytes_received = server_stats(server_url)
+    total.bytes_uploaded = upload.bytes_uploaded
+    total.peak_rss_mb = peak_rss_mb()
+    return [s.as_dict() for s in stages + [upload, total]]
+
+
+def spawn_pipeline(name, server_url, work_path, window_days):
+    result_path = os.path.join(work_path, '%s.json' % name)
+    run_path = os.path.join(work_path, name)
+    os.makedirs(run_path, exist_ok=True)
+    # the response cache is off by default; the benchmarks keep it on so that
+    # runs reusing --work-dir measure warm starts
+    env = dict(os.environ, API_KEY='bench', S3_BUCKET='bench', CACHE_BACKEND='s3',
+               PYTHONDONTWRITEBYTECODE='1')
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--run', name,
+                    '--server', server_url, '--s3', os.path.join(work_path, 's3'),
+                    '--window-days', str(window_days), '--result', result_path],
+                   cwd=run_path, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def print_results(results):
+    print('%-10s %-30s %6s %9s %9s %10s %10s %9s' % (
+        'pipeline', 'stage', 'calls', 'wall s', 'requests', 'recv MiB', 'sent MiB', 'RSS MiB'))
+    for name, stages in results.items():
+        for s in stages:
+            print('%-10s %-30s %6d %9.2f %9d %10.2f %10.2f %9.1f' % (
+                name, s['name'], s['calls'], s['seconds'], s['requests'],
+                s['bytes_received'] / 2 ** 20, s['bytes_uploaded'] / 2 ** 20, s['peak_rss_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the report pipelines')
+    parser.add_argument('fixtures', nargs='?')
+    parser.add_argument('--pipelines', nargs='+', default=list(PIPELINES), choices=list(PIPELINES))
+    parser.add_argument('--window-days', type=int, default=1,
+                        help='days each report covers (settings are overridden)')
+    parser.add_argument('--checks', type=int, default=200)
+    parser.add_argument('--pagerduty-incidents', type=int, default=2000)
+    parser.add_argument('--statuspage-incidents', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=1095)
+    parser.add_argument('--pingdom-days', type=int, default=30)
+    parser.add_argument('--work-dir', help='keep output and the local S3 here across runs')
+    parser.add_argument('--port', type=int, default=0,
+                        help='fixed replay server port, so cached responses match across runs')
+    parser.add_argument('--json', help='also write results to this file')
+    # internal: run a single pipeline in this process
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--server', help=argparse.SUPPRESS)
+    parser.add_argument('--s3', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        stages = run_pipeline(args.run, args.server, args.s3, args.window_days)
+        with open(args.result, 'w') as f:
+            json.dump(stages, f)
+        return
+
+    if not args.fixtures:
+        parser.error('FIXTURES is required')
+    sys.path[:0] = [BENCH]
+    import fixtures
+    from replay import Fixtures, ReplayServer
+
+    if not os.path.exists(args.fixtures):
+        print('generating fixtures in %s' % args.fixtures)
+        fixtures.generate(args.fixtures, args.checks, args.pagerduty_incidents,
+                          args.statuspage_incidents, args.days, args.pingdom_days)
+    server = ReplayServer(Fixtures(args.fixtures), port=args.port).start()
+    work_path = args.work_dir or tempfile.mkdtemp(prefix='report-bench-')
+    results = {}
+    try:
+        for name in args.pipelines:
+            server.requests.clear()
+            server.bytes.clear()
+            results[name] = spawn_pipeline(name, server.url, work_path, args.window_days)
+    finally:
+        server.stop()
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
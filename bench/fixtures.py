@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Synthetic API fixtures for the replay server.
+#
+# Files are plain API payloads (the same shape Pingdom, PagerDuty and
+# Statuspage return), so recorded responses can be dropped in alongside or
+# instead of generated ones:
+#
+#   pingdom/checks.json              {"checks": [...]}
+#   pingdom/outages.json             {"<check id>": [state, ...]}
+#   pagerduty/users.json             [user, ...]
+#   pagerduty/incidents.json         [incident, ...] oldest first
+#   pagerduty/log_entries.json       [log entry, ...] newest first
+#   statuspage/components.json       [component, ...]
+#   statuspage/incidents.json        [incident, ...] newest first
+
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import os
+import random
+
+SEED_COMPONENTS = os.path.join(os.path.dirname(__file__), '..', 'slo', 'components.json')
+
+TIME_ZONES = ['America/Los_Angeles', 'America/New_York', 'Europe/Berlin',
+              'Europe/London', 'Asia/Taipei', 'Australia/Sydney']
+SERVICES = ['Web', 'Sync', 'Push', 'Accounts', 'Out of hours', 'Remote access monitoring',
+            'Telemetry', 'Symbols', 'Crash reports', 'Fraud Auth Service']
+
+
+def pagerduty_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def statuspage_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def write_json(base_path, name, data):
+    path = os.path.join(base_path, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def generate_pingdom(rng, now, num_checks, days):
+    checks = []
+    outages = {}
+    start = int((now - timedelta(days=days)).timestamp())
+    end = int(now.timestamp())
+    for n in range(num_checks):
+        check_id = 1000000 + n
+        checks.append({
+            'id': check_id,
+            'name': 'check-%d' % n,
+            'status': 'up',
+            'lasterrortime': 0,
+            'tags': [{'name': rng.choice(SERVICES).lower().replace(' ', '-'), 'type': 'u'}],
+        })
+        # alternating up/down states covering the whole window
+        states = []
+        t = start
+        while t < end:
+            status = 'down' if states and states[-1]['status'] == 'up' else 'up'
+            length = rng.randint(60, 600) if status == 'down' else rng.randint(3600, 86400 * 3)
+            states.append({'status': status, 'timefrom': t, 'timeto': min(t + length, end)})
+            t += length
+        checks[-1]['lasterrortime'] = max([s['timefrom'] for s in states if s['status'] == 'down'] or [0])
+        outages[check_id] = states
+    return {'checks': checks}, outages
+
+
+def generate_pagerduty(rng, now, num_incidents, days):
+    users = [{'id': 'PU%04d' % n, 'name': 'User %d' % n, 'time_zone': rng.choice(TIME_ZONES)}
+             for n in range(50)]
+    start = now - timedelta(days=days)
+    created = sorted(start + timedelta(seconds=rng.randint(0, days * 86400))
+                     for _ in range(num_incidents))
+    incidents = []
+    log_entries = []
+    for n, created_at in enumerate(created):
+        incident_id = 'PI%06d' % n
+        service = rng.choice(SERVICES)
+        ref = {'id': incident_id, 'type': 'incident_reference'}
+        entries = [{'type': 'trigger_log_entry', 'created_at': created_at, 'incident': ref}]
+        t = created_at
+        notified = rng.sample(users, rng.randint(1, 3))
+        for user in notified:
+            t += timedelta(seconds=rng.randint(1, 120))
+            entries.append({'type': 'notify_log_entry', 'created_at': t, 'incident': ref,
+                            'user': {'id': user['id'], 'summary': user['name']}})
+        for user in notified[:rng.randint(0, 2)]:
+            t += timedelta(seconds=rng.randint(30, 1800))
+            entries.append({'type': 'acknowledge_log_entry', 'created_at': t, 'incident': ref,
+                            'agent': {'id': user['id'], 'summary': user['name']}})
+        t += timedelta(seconds=rng.randint(60, 6 * 3600))
+        status = 'resolved' if t < now else 'acknowledged'
+        if status == 'resolved':
+            entries.append({'type': 'resolve_log_entry', 'created_at': t, 'incident': ref,
+                            'agent': {'id': notified[0]['id'], 'summary': notified[0]['name']}})
+        for entry in entries:
+            entry['id'] = 'PL%08d' % len(log_entries)
+            entry['created_at'] = pagerduty_time(entry['created_at'])
+            log_entries.append(entry)
+        incidents.append({
+            'id': incident_id,
+            'title': '%s is down' % service,
+            'status': status,
+            'urgency': rng.choice(['high', 'low', 'low']),
+            'created_at': pagerduty_time(created_at),
+            'service': {'id': 'PS%02d' % SERVICES.index(service), 'summary': service},
+            'escalation_policy': {'id': 'PE01', 'summary': 'Default'},
+        })
+    log_entries.sort(key=lambda e: e['created_at'], reverse=True)
+    return users, incidents, log_entries
+
+
+def generate_statuspage(rng, now, num_incidents, days):
+    with open(SEED_COMPONENTS) as f:
+        components = json.load(f)
+    group_ids = {c['id'] for c in components if c['group']}
+    affectable = [c for c in components if c['group_id'] in group_ids]
+    start = now - timedelta(days=days)
+    incidents = []
+    for n in range(num_incidents):
+        created_at = start + timedelta(seconds=rng.randint(0, days * 86400))
+        resolved_at = created_at + timedelta(seconds=rng.randint(300, 8 * 3600))
+        updated_at = resolved_at + timedelta(seconds=rng.randint(0, 7 * 86400))
+        postmortem = rng.choice([None, 'Root cause was a bad deploy.', 'False positive, ignore.'])
+        incidents.append({
+            'id': 'sp%08d' % n,
+            'name': 'Degraded performance %d' % n,
+            'status': 'resolved',
+            'impact': rng.choice(['minor', 'major', 'critical']),
+            'created_at': statuspage_time(created_at),
+            'resolved_at': statuspage_time(resolved_at),
+            'updated_at': statuspage_time(min(updated_at, now)),
+            'postmortem_body': postmortem,
+            'components': rng.sample(affectable, rng.randint(1, 2)),
+            'incident_updates': [{'body': 'Update %d about the problem.' % u}
+                                 for u in range(rng.randint(1, 4))],
+        })
+    incidents.sort(key=lambda i: i['created_at'], reverse=True)
+    return components, incidents
+
+
+def generate(base_path, checks, pagerduty_incidents, statuspage_incidents, days,
+             pingdom_days=30, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    # every state of every check is kept in memory, so pingdom history is
+    # generated for a shorter window than the incident sources
+    checks_payload, outages = generate_pingdom(rng, now, checks, pingdom_days)
+    write_json(base_path, 'pingdom/checks.json', checks_payload)
+    write_json(base_path, 'pingdom/outages.json', outages)
+    users, incidents, log_entries = generate_pagerduty(rng, now, pagerduty_incidents, days)
+    write_json(base_path, 'pagerduty/users.json', users)
+    write_json(base_path, 'pagerduty/incidents.json', incidents)
+    write_json(base_path, 'pagerduty/log_entries.json', log_entries)
+    components, incidents = generate_statuspage(rng, now, statuspage_incidents, days)
+    write_json(base_path, 'statuspage/components.json', components)
+    write_json(base_path, 'statuspage/incidents.json', incidents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic API fixtures')
+    parser.add_argument('output')
+    parser.add_argument('--checks', type=int, default=200)
+    parser.add_argument('--pagerduty-incidents', type=int, default=2000)
+    parser.add_argument('--statuspage-incidents', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=1095)
+    parser.add_argument('--pingdom-days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.output, args.checks, args.pagerduty_incidents,
+             args.statuspage_incidents, args.days, args.pingdom_days, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+# Replays fixture files (see fixtures.py) as the Pingdom, PagerDuty and
+# Statuspage APIs, and provides a local stand-in for the S3 client.
+#
+# The server mimics only the endpoints and paging the reports use, and
+# counts requests and response bytes per API so benchmarks can report them.
+
+import asyncio
+import collections
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+
+from aiohttp import web
+from botocore.exceptions import ClientError
+
+
+def load(base_path, name):
+    with open(os.path.join(base_path, name)) as f:
+        return json.load(f)
+
+
+def pagerduty_time(value):
+    # PagerDuty accepts dates as well as full timestamps; normalised to the
+    # format fixtures use, those compare correctly as strings
+    if len(value) == 10:
+        value += 'T00:00:00Z'
+    return value[:19] + 'Z'
+
+
+class Fixtures:
+    def __init__(self, base_path):
+        self.checks = load(base_path, 'pingdom/checks.json')
+        self.outages = load(base_path, 'pingdom/outages.json')
+        self.users = load(base_path, 'pagerduty/users.json')
+        self.incidents = load(base_path, 'pagerduty/incidents.json')
+        self.log_entries = load(base_path, 'pagerduty/log_entries.json')
+        self.services = sorted({incident['service']['id']: {'id': incident['service']['id'],
+                                                             'name': incident['service']['summary']}
+                                for incident in self.incidents}.values(), key=lambda service: service['id'])
+        self.log_entries_by_incident = collections.defaultdict(list)
+        for entry in self.log_entries:
+            self.log_entries_by_incident[entry['incident']['id']].append(entry)
+        self.components = load(base_path, 'statuspage/components.json')
+        self.statuspage_incidents = load(base_path, 'statuspage/incidents.json')
+
+
+class ReplayServer:
+    def __init__(self, fixtures, host='127.0.0.1', port=0):
+        self.fixtures = fixtures
+        self.host = host
+        self.port = port
+        self.requests = collections.Counter()
+        self.bytes = collections.Counter()
+        self._runner = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % (self.host, self.port)
+
+    def stats(self):
+        return {'requests': dict(self.requests), 'bytes': dict(self.bytes)}
+
+    def json_response(self, api, data, headers=None):
+        body = json.dumps(data).encode()
+        self.requests[api] += 1
+        self.bytes[api] += len(body)
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    # pingdom
+
+    async def pingdom_checks(self, request):
+        return self.json_response('pingdom', self.fixtures.checks, self.pingdom_headers())
+
+    async def pingdom_outages(self, request):
+        from_ = int(request.query.get('from', 0))
+        to_ = int(request.query.get('to', 2 ** 32))
+        states = [s for s in self.fixtures.outages.get(request.match_info['check_id'], [])
+                  if s['timeto'] > from_ and s['timefrom'] < to_]
+        return self.json_response('pingdom', {'summary': {'states': states}}, self.pingdom_headers())
+
+    def pingdom_headers(self):
+        return {'Req-Limit-Short': 'Remaining: 100000 Time until reset: 60',
+                'Req-Limit-Long': 'Remaining: 1000000 Time until reset: 3600'}
+
+    # pagerduty
+
+    def pagerduty_page(self, key, items, query):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 25))
+        page = items[offset:offset + limit]
+        return self.json_response('pagerduty', {
+            key: page, 'offset': offset, 'limit': limit,
+            'more': offset + limit < len(items), 'total': None})
+
+    def in_window(self, items, query, field='created_at'):
+        since = pagerduty_time(query['since']) if 'since' in query else None
+        until = pagerduty_time(query['until']) if 'until' in query else None
+        for item in items:
+            created = item[field]
+            if since and created < since:
+                continue
+            if until and created >= until:
+                continue
+            yield item
+
+    async def pagerduty_users(self, request):
+        return self.pagerduty_page('users', self.fixtures.users, request.query)
+
+    async def pagerduty_services(self, request):
+        return self.pagerduty_page('services', self.fixtures.services, request.query)
+
+    async def pagerduty_incidents(self, request):
+        service_ids = set(request.query.getall('service_ids[]', []))
+        urgencies = set(request.query.getall('urgencies[]', []))
+        incidents = [incident for incident in self.in_window(self.fixtures.incidents, request.query)
+                     if (not service_ids or incident['service']['id'] in service_ids) and
+                     (not urgencies or incident['urgency'] in urgencies)]
+        return self.pagerduty_page('incidents', incidents, request.query)
+
+    async def pagerduty_log_entries(self, request):
+        entries = list(self.in_window(self.fixtures.log_entries, request.query))
+        return self.pagerduty_page('log_entries', entries, request.query)
+
+    async def pagerduty_incident_log_entries(self, request):
+        entries = self.fixtures.log_entries_by_incident[request.match_info['incident_id']]
+        return self.pagerduty_page('log_entries', entries, request.query)
+
+    # statuspage
+
+    def statuspage_page(self, items, request):
+        page = int(request.query.get('page', 1))
+        return self.json_response('statuspage', items[(page - 1) * 100:page * 100])
+
+    async def statuspage_components(self, request):
+        return self.statuspage_page(self.fixtures.components, request)
+
+    async def statuspage_incidents(self, request):
+        return self.statuspage_page(self.fixtures.statuspage_incidents, request)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/pingdom/checks', self.pingdom_checks)
+        app.router.add_get('/pingdom/summary.outage/{check_id}/', self.pingdom_outages)
+        app.router.add_get('/pagerduty/users', self.pagerduty_users)
+        app.router.add_get('/pagerduty/services', self.pagerduty_services)
+        app.router.add_get('/pagerduty/incidents', self.pagerduty_incidents)
+        app.router.add_get('/pagerduty/incidents/{incident_id}/log_entries',
+                           self.pagerduty_incident_log_entries)
+        app.router.add_get('/pagerduty/log_entries', self.pagerduty_log_entries)
+        app.router.add_get('/statuspage/pages/{page_id}/components.json/', self.statuspage_components)
+        app.router.add_get('/statuspage/pages/{page_id}/incidents.json/', self.statuspage_incidents)
+        app.router.add_get('/__stats', lambda request: web.json_response(self.stats()))
+        return app
+
+    async def _start(self):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        # serve from a background thread so callers can stay synchronous
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class LocalPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix=''):
+        contents = [{'Key': key, 'ETag': '"%s"' % etag, 'Size': size}
+                    for key, (etag, size) in sorted(self.client.objects(Prefix).items())]
+        yield {'Contents': contents}
+
+
+# Enough of the boto3 S3 client for S3Uploader, backed by a local directory.
+class LocalS3Client:
+    def __init__(self, base_path):
+        self.base_path = base_path
+        self.put_count = 0
+        self.bytes_uploaded = 0
+        self._parts = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.base_path, key)
+
+    def objects(self, prefix):
+        found = {}
+        for root, _, files in os.walk(self.base_path):
+            for name in files:
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, self.base_path)
+                if key.startswith(prefix):
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    found[key] = (hashlib.md5(data).hexdigest(), len(data))
+        return found
+
+    def _store(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self.put_count += 1
+            self.bytes_uploaded += len(data)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, 'rb') as f:
+            self._store(Key, f.read())
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._store(Key, Body.encode() if isinstance(Body, str) else Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = '%s:%d' % (Key, len(self._parts))
+        self._parts[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        data = Body.read()
+        self._parts[UploadId][PartNumber] = data
+        return {'ETag': '"%s"' % hashlib.md5(data).hexdigest()}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self._parts.pop(UploadId)
+        self._store(Key, b''.join(parts[p['PartNumber']] for p in MultipartUpload['Parts']))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._parts.pop(UploadId, None)
+
+    def get_object(self, Bucket, Key):
+        try:
+            with open(self._path(Key), 'rb') as f:
+                return {'Body': io.BytesIO(f.read())}
+        except FileNotFoundError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Key))
+        except FileNotFoundError:
+            pass
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return LocalPaginator(self)
+
+    def clear(self):
+        shutil.rmtree(self.base_path, ignore_errors=True)
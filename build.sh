@@ -3,15 +3,33 @@ set -e
 set -x
 
 REPORT=$1
+SLIM=$2
 CODE="${REPORT}/${REPORT}_report.py"
 WORKDIR="${REPORT}-lambda"
 ARTIFACT="${REPORT}-lambda.zip"
+PYTHON_IMAGE="${PYTHON_IMAGE:-python:3.6}"
+# botocore service models the reports use: s3 for output, the cache and
+# checkpoints, lambda for chaining runs
+BOTOCORE_SERVICES="${BOTOCORE_SERVICES:-s3 lambda}"
 
 if [[ ! -f $CODE ]]; then
     echo Cannot find $CODE
     exit 1
 fi
 
+if [[ -n $SLIM && $SLIM != --slim ]]; then
+    echo "Usage: $0 REPORT [--slim]"
+    exit 1
+fi
+
+# heavy modules the report only imports once it starts fetching/uploading
+case $REPORT in
+    incident) DEFERRED="requests pytz boto3" ;;
+    pingdom) DEFERRED="aiohttp boto3" ;;
+    slo) DEFERRED="requests boto3" ;;
+    combined) DEFERRED="aiohttp pytz requests boto3" ;;
+esac
+
 if [[ -f $ARTIFACT ]]; then
     rm $ARTIFACT
 fi
@@ -22,18 +40,66 @@ fi
 
 mkdir $WORKDIR
 
-PIP_CMD="pip3 install -r $REPORT/requirements.txt -t $WORKDIR/"
+# run a command with the python the bundle is built for
+in_build_env() {
+    if command -v pip3 >/dev/null; then
+        "$@"
+    elif command -v docker >/dev/null; then
+        docker run -u $UID -w /root -v $(pwd):/root $PYTHON_IMAGE "$@"
+    else
+        echo 'You must have either python 3 or docker installed to build'
+        exit 1
+    fi
+}
 
-if command -v pip3 >/dev/null; then
-    $PIP_CMD
-elif command -v docker >/dev/null; then
-    docker run -u $UID -w /root -v $(pwd):/root python:3.6 $PIP_CMD
-else
-    echo 'You must have either python 3 or docker installed to build'
-    exit 1
-fi
+in_build_env pip3 install -r $REPORT/requirements.txt -t $WORKDIR/
 
 cp $CODE $REPORT/settings.py $WORKDIR/
+# modules shared by all the reports
+cp common/*.py $WORKDIR/
+if [[ $REPORT == combined ]]; then
+    # each report keeps its own directory (and settings) in the bundle
+    for source in pingdom incident slo; do
+        mkdir $WORKDIR/$source
+        cp $source/${source}_report.py $source/settings.py $WORKDIR/$source/
+    done
+fi
+
+if [[ -n $SLIM ]]; then
+    for models in $WORKDIR/botocore/data/*/ $WORKDIR/boto3/data/*/; do
+        if [[ -d $models && " $BOTOCORE_SERVICES " != *" $(basename $models) "* ]]; then
+            rm -r $models
+        fi
+    done
+    find $WORKDIR -type d \( -name __pycache__ -o -name tests -o -name test \
+        -o -name '*.dist-info' -o -name '*.egg-info' \) -prune -exec rm -r {} +
+    # lambda's filesystem is read-only, so without bytecode in the bundle
+    # every cold start compiles everything it imports. Hash-based pycs stay
+    # valid however the zip records mtimes, but need python 3.7+ (matching
+    # the lambda runtime; set PYTHON_IMAGE when building with docker). Older
+    # pycs check the source mtime, which the zip's 2 second resolution can
+    # change, so on 3.6 the bundle is left without bytecode.
+    if in_build_env python3 -c 'import sys; sys.exit(sys.version_info < (3, 7))'; then
+        in_build_env python3 -m compileall -q -j 0 --invalidation-mode unchecked-hash $WORKDIR
+    else
+        echo 'Skipping precompiled bytecode: it needs python 3.7+ (set PYTHON_IMAGE)'
+    fi
+fi
+
+# tracked per build so cold start regressions show up
+in_build_env env API_KEY=build S3_BUCKET=build python3 -c "
+import importlib, sys, time
+sys.path.insert(0, '$WORKDIR')
+started = time.perf_counter()
+import ${REPORT}_report
+report = time.perf_counter() - started
+for name in '$DEFERRED'.split():
+    importlib.import_module(name)
+print('import time: %.0f ms (%.0f ms with $DEFERRED)' % (
+    report * 1000, (time.perf_counter() - started) * 1000))
+" || echo 'Could not import the bundle with the build python'
 
 cd $WORKDIR
-zip -r9 ../$ARTIFACT .
+zip -qr9 ../$ARTIFACT .
+cd ..
+echo "zip size: $(( $(wc -c < $ARTIFACT) / 1024 )) KiB"
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Runs several reports in one process, so a single lambda (with one cold
+# start) collects them all and the run takes as long as the slowest report
+# rather than their sum.
+#
+# Each report is a source plugin: its module is loaded with its own
+# settings, and its entry point runs on one shared event loop. Pingdom's is
+# a coroutine and runs on the loop directly; PagerDuty's and Statuspage's
+# clients are synchronous, so theirs run on the loop's worker threads. All
+# of them upload through one pooled S3 client.
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from metrics import Metrics, profiled
+from uploader import S3Uploader, make_client
+import asyncio
+import importlib.util
+import os
+import settings
+import sys
+
+metrics = Metrics()
+
+
+class Source:
+    def __init__(self, name, entry_point):
+        self.name = name
+        self.entry_point = entry_point
+        self.module = None
+
+    def load(self):
+        report_dir = find_report_dir(self.name)
+        with source_environment(self.name):
+            source_settings = load_module('%s_settings' % self.name,
+                                          os.path.join(report_dir, 'settings.py'))
+        # the combined run is profiled as a whole
+        source_settings.PROFILE_PATH = None
+        # the report's `import settings` picks up its own
+        previous = sys.modules.get('settings')
+        sys.modules['settings'] = source_settings
+        try:
+            self.module = load_module('%s_report' % self.name,
+                                      os.path.join(report_dir, '%s_report.py' % self.name))
+        finally:
+            sys.modules['settings'] = previous
+        self.module.S3Uploader = partial(S3Uploader, client=get_s3_client())
+
+    async def run(self, event, context):
+        entry_point = getattr(self.module, self.entry_point)
+        with metrics.stage(self.name):
+            if asyncio.iscoroutinefunction(entry_point):
+                await entry_point(event, context)
+            else:
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(get_executor(), entry_point, event, context)
+
+
+SOURCES = {
+    'pingdom': Source('pingdom', 'main'),
+    'incident': Source('incident', 'lambda_handler'),
+    'slo': Source('slo', 'lambda_handler'),
+}
+
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    # kept across warm starts and shared by the reports' per-run uploaders
+    return make_client(settings.S3_MAX_CONNECTIONS)
+
+
+@lru_cache(maxsize=1)
+def get_executor():
+    return ThreadPoolExecutor(max_workers=settings.SYNC_SOURCE_WORKERS)
+
+
+def find_report_dir(name):
+    here = os.path.dirname(os.path.abspath(__file__))
+    for report_path in settings.REPORT_PATHS:
+        report_dir = os.path.normpath(os.path.join(here, report_path, name))
+        if os.path.isfile(os.path.join(report_dir, 'settings.py')):
+            return report_dir
+    raise ValueError('cannot find the %s report' % name)
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def source_environment(name):
+    # e.g. PINGDOM_API_KEY is seen as API_KEY while pingdom's settings load
+    prefix = '%s_' % name.upper()
+    overrides = {key[len(prefix):]: value for key, value in os.environ.items()
+                 if key.startswith(prefix)}
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def source_event(event, name):
+    # a report that chains itself re-invokes this lambda with its own event,
+    # which only asks for that report again
+    event = {key: value for key, value in event.items() if key != 'profile'}
+    event['sources'] = [name]
+    return event
+
+
+async def run_sources(names, event, context):
+    sources = [SOURCES[name] for name in names]
+    for source in sources:
+        if source.module is None:
+            source.load()
+    # one report failing doesn't stop the others
+    results = await asyncio.gather(
+        *(source.run(source_event(event, source.name), context) for source in sources),
+        return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    metrics.count('sources_failed', len(errors))
+    if errors:
+        raise errors[0]
+
+
+async def main(event=None, context=None):
+    # event may hold {"sources": [...]} and/or {"profile": path}, plus
+    # anything the reports take (e.g. a backfill range)
+    event = event or {}
+    names = event.get('sources') or settings.SOURCES
+    try:
+        with profiled(event.get('profile') or settings.PROFILE_PATH), metrics.stage('total'):
+            await run_sources(names, event, context)
+    finally:
+        metrics.flush(settings.METRICS_OUTPUT, settings.METRICS_NAMESPACE, {'Report': 'combined'})
+
+
+def lambda_handler(event, context):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(event, context))
+
+
+if __name__ == '__main__':
+    # combined_report.py [SOURCE ...] to run only some of the reports
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main({'sources': sys.argv[1:]}))
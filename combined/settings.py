@@ -0,0 +1,24 @@
+import os
+
+# reports run together in one process by combined_report.py, unless the lambda
+# event names its own {"sources": [...]}. Each one is configured by its own
+# settings.py; environment variables prefixed with its name (e.g.
+# PINGDOM_API_KEY, INCIDENT_API_KEY) override the unprefixed ones for it alone.
+SOURCES = os.environ.get('SOURCES', 'pingdom incident').split()
+# where the reports' directories are, relative to this file: next to it in the
+# lambda bundle, one level up in the repo
+REPORT_PATHS = ['.', '..']
+# connections in the S3 pool shared by every report's uploads
+S3_MAX_CONNECTIONS = int(os.environ.get('S3_MAX_CONNECTIONS', 32))
+# threads for the reports whose API clients are synchronous (PagerDuty and
+# Statuspage); pingdom runs on the event loop itself
+SYNC_SOURCE_WORKERS = 4
+
+# where run metrics go: 'emf' prints CloudWatch embedded metric format lines to
+# stdout (picked up from the lambda's logs), a path appends them to that file, '' for none.
+# Each report still flushes its own metrics; these are the combined run's.
+METRICS_OUTPUT = os.environ.get('METRICS_OUTPUT', 'emf')
+METRICS_NAMESPACE = 'MonitoringReports'
+# write a cProfile dump (and top memory allocations) of the whole run here; a
+# lambda event can also ask for a single profiled run with {"profile": "/tmp/run.prof"}
+PROFILE_PATH = os.environ.get('PROFILE_PATH') or None
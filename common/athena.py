@@ -0,0 +1,65 @@
+# DDL for the Athena tables over the reports' output, shared by the
+# setup_athena*.py scripts, which pass their columns as (name, type) pairs.
+# Every table goes in the monitoring_reports database.
+
+DATABASE = 'monitoring_reports'
+
+
+def database_query():
+    return 'CREATE DATABASE IF NOT EXISTS %s;' % DATABASE
+
+
+def column_list(columns):
+    return ',\n'.join('  `%s` %s' % column for column in columns)
+
+
+def json_table_query(bucket, prefix, columns):
+    # JSON lines (OUTPUT_FORMAT = 'json') under <prefix>/
+    return """CREATE EXTERNAL TABLE IF NOT EXISTS %s.%s (
+%s
+)
+ROW FORMAT SERDE 'org.apache.hive.hcatalog.data.JsonSerDe'
+LOCATION 's3://%s/%s/'
+TBLPROPERTIES ('has_encrypted_data'='false');
+""" % (DATABASE, prefix, column_list(columns), bucket, prefix)
+
+
+def parquet_table_query(bucket, prefix, columns):
+    # Parquet output (OUTPUT_FORMAT = 'parquet') lives under <prefix>_parquet/dt=YYYY-MM-DD/
+    # partition projection means no MSCK REPAIR / crawler is needed for new days
+    return """CREATE EXTERNAL TABLE IF NOT EXISTS %s.%s_parquet (
+%s
+)
+PARTITIONED BY (`dt` string)
+STORED AS PARQUET
+LOCATION 's3://%s/%s_parquet/'
+TBLPROPERTIES (
+  'has_encrypted_data'='false',
+  'projection.enabled'='true',
+  'projection.dt.type'='date',
+  'projection.dt.format'='yyyy-MM-dd',
+  'projection.dt.range'='2017-01-01,NOW',
+  'projection.dt.interval'='1',
+  'projection.dt.interval.unit'='DAYS',
+  'storage.location.template'='s3://%s/%s_parquet/dt=${dt}/'
+);
+""" % (DATABASE, prefix, column_list(columns), bucket, prefix, bucket, prefix)
+
+
+def rollup_table_queries(bucket, name, columns):
+    # weekly and monthly rollups the report keeps up to date next to the day
+    # files, under <name>_weekly/ and <name>_monthly/
+    return [json_table_query(bucket, '%s_%s' % (name, period), columns)
+            for period in ('weekly', 'monthly')]
+
+
+def run_queries(bucket, queries):
+    # query results go under setup/ in the bucket
+    import boto3
+
+    client = boto3.client('athena')
+    result_configuration = {'OutputLocation': 's3://%s/setup/' % bucket}
+    for query in queries:
+        print(query)
+        client.start_query_execution(QueryString=query,
+                                     ResultConfiguration=result_configuration)
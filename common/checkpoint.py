@@ -0,0 +1,167 @@
+# Checkpoints for resumable report runs.
+#
+# A run keeps its progress (pages fetched, checks or days done) in a JSON
+# checkpoint tied to the job it belongs to, e.g. the date range being
+# reported on. If the run fails, the next invocation of the same job picks up
+# from the checkpoint. On lambda, a run that gets close to the time limit
+# stops, saves the checkpoint and re-invokes itself to carry on. Progress too
+# big to keep in the state (e.g. fetched data) is saved as numbered parts
+# next to the checkpoint, one per batch, and only read back on resume.
+
+from contextlib import contextmanager
+import json
+import os
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class FileStore:
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, body):
+        # write then rename, so a crash never leaves half a checkpoint
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(body)
+        os.replace(self.path + '.tmp', self.path)
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def part(self, n):
+        return FileStore('%s.%d' % (self.path, n))
+
+
+class S3Store:
+    def __init__(self, uploader, key):
+        self.uploader = uploader
+        self.key = key
+
+    def read(self):
+        return self.uploader.read_object(self.key)
+
+    def write(self, body):
+        self.uploader.write_object(self.key, body)
+
+    def delete(self):
+        self.uploader.delete_object(self.key)
+
+    def part(self, n):
+        return S3Store(self.uploader, '%s.%d' % (self.key, n))
+
+
+class NullStore:
+    def read(self):
+        return None
+
+    def write(self, body):
+        pass
+
+    def delete(self):
+        pass
+
+    def part(self, n):
+        return self
+
+
+class Checkpoint:
+    def __init__(self, store, job):
+        # a checkpoint left by a different job (another date range, or
+        # yesterday's daily run) is ignored and overwritten
+        self.store = store
+        self.job = job
+        body = store.read()
+        saved = json.loads(body) if body else None
+        self.state = saved['state'] if saved and saved['job'] == job else {}
+        self.resumed = bool(self.state)
+
+    def save(self):
+        self.store.write(json.dumps({'job': self.job, 'state': self.state}))
+
+    def save_part(self, body):
+        # kept once the state that counts it is saved
+        n = self.state.get('parts', 0)
+        self.store.part(n).write(body)
+        self.state['parts'] = n + 1
+
+    def parts(self):
+        for n in range(self.state.get('parts', 0)):
+            yield self.store.part(n).read()
+
+    def clear(self):
+        for n in range(self.state.get('parts', 0)):
+            self.store.part(n).delete()
+        self.store.delete()
+        self.state = {}
+
+
+def open_checkpoint(backend, job, path=None, uploader=None, key=None):
+    # backend is 'file' (path), 's3' (uploader and key) or None to disable
+    if backend == 'file':
+        return Checkpoint(FileStore(path), job)
+    if backend == 's3':
+        return Checkpoint(S3Store(uploader, key), job)
+    if backend is None:
+        return Checkpoint(NullStore(), job)
+    raise ValueError('unknown checkpoint backend: %s' % backend)
+
+
+def open_report_checkpoint(settings, job, uploader):
+    # with a report's CHECKPOINT_* settings
+    return open_checkpoint(settings.CHECKPOINT_BACKEND, job, settings.CHECKPOINT_PATH,
+                           uploader, settings.CHECKPOINT_KEY)
+
+
+class Deadline:
+    # context is the lambda context, or None when run locally (no limit)
+    def __init__(self, context, margin_seconds):
+        self.context = context
+        self.margin_ms = margin_seconds * 1000
+
+    def running_low(self):
+        return (self.context is not None and
+                self.context.get_remaining_time_in_millis() < self.margin_ms)
+
+    def check(self):
+        if self.running_low():
+            raise OutOfTime()
+
+
+def chain(context, event, max_chained_runs):
+    # re-invoke this function asynchronously to carry on from the checkpoint
+    chained_runs = event.get('chained_runs', 0)
+    if chained_runs >= max_chained_runs:
+        raise RuntimeError('still unfinished after %d chained runs' % chained_runs)
+    import boto3
+    boto3.client('lambda').invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(dict(event, chained_runs=chained_runs + 1)).encode())
+
+
+@contextmanager
+def resumable(checkpoint, event, context, max_chained_runs):
+    # the checkpoint is kept for a retry if the run fails, handed on to a
+    # chained invocation if it runs out of time, and cleared once it's done
+    try:
+        yield
+    except OutOfTime:
+        checkpoint.save()
+        chain(context, event or {}, max_chained_runs)
+    except BaseException:
+        checkpoint.save()
+        raise
+    else:
+        checkpoint.clear()
@@ -0,0 +1,85 @@
+# Streaming JSON lines output for the reports.
+#
+# Rows are serialised one at a time into a buffered file, so memory stays
+# flat however many rows a report has. orjson is used when it's bundled;
+# the fallback produces the same compact UTF-8 lines, so output doesn't
+# depend on which one ran. Output bigger than max_bytes is rotated out in
+# parts as it's written, and each finished part is handed to on_part (e.g.
+# S3Uploader's multipart upload), so only one part is on local disk at once.
+
+import hashlib
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(row):
+    if orjson is not None:
+        return orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(row, separators=(',', ':'), ensure_ascii=False) + '\n').encode()
+
+
+class JSONLinesWriter:
+    def __init__(self, path, max_bytes=None, on_part=None, buffer_size=1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.on_part = on_part
+        self.buffer_size = buffer_size
+        self.rows = 0
+        self.size = 0
+        self.parts = 0
+        self._part_size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(path, 'wb', buffering=buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def rotated(self):
+        # once rotated, all the output went to on_part and none is left at path
+        return self.parts > 0
+
+    def sha256(self):
+        # of everything written, across parts
+        return self._digest.hexdigest()
+
+    def write(self, row):
+        line = dumps(row)
+        if self.max_bytes and self._part_size and self._part_size + len(line) > self.max_bytes:
+            self._hand_off()
+            self._file = open(self.path, 'wb', buffering=self.buffer_size)
+        self._file.write(line)
+        self._digest.update(line)
+        self._part_size += len(line)
+        self.size += len(line)
+        self.rows += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def _hand_off(self):
+        # parts get their own name, so on_part can upload one in the
+        # background while the next is written
+        self._file.close()
+        part_path = '%s.%d' % (self.path, self.parts)
+        os.replace(self.path, part_path)
+        self.parts += 1
+        self._part_size = 0
+        self.on_part(part_path)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.rotated:
+            self._hand_off()
+        else:
+            self._file.close()
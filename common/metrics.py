@@ -0,0 +1,102 @@
+# Per-run stage timings and counters for the report lambdas.
+#
+# Each report keeps one Metrics instance, times its stages and counts
+# requests, retries, bytes and rows as it goes, and flushes them at the end
+# of the run as a CloudWatch embedded metric format (EMF) line: printed to
+# stdout on lambda, where CloudWatch Logs turns it into metrics, or appended
+# to a local file when run offline.
+
+from contextlib import contextmanager
+import collections
+import json
+import sys
+import threading
+import time
+
+
+def metric_unit(name):
+    if name.endswith('_seconds'):
+        return 'Seconds'
+    if name.endswith('_bytes'):
+        return 'Bytes'
+    return 'Count'
+
+
+class Metrics:
+    def __init__(self):
+        self.values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.values[name] += value
+
+    @contextmanager
+    def stage(self, name):
+        # stages can nest and run on several threads; each adds its own
+        # wall time, so nested stages are included in their parent's
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count('%s_seconds' % name, time.perf_counter() - started)
+
+    def emf(self, namespace, dimensions):
+        with self._lock:
+            values = dict(self.values)
+        metrics = [{'Name': name, 'Unit': metric_unit(name)} for name in sorted(values)]
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [sorted(dimensions)],
+                    'Metrics': metrics,
+                }],
+            },
+        }
+        record.update(dimensions)
+        record.update(values)
+        return record
+
+    def flush(self, output, namespace, dimensions):
+        # output is 'emf' for stdout, a file path, or None to just reset
+        record = self.emf(namespace, dimensions)
+        with self._lock:
+            self.values.clear()
+        if not output:
+            return
+        line = json.dumps(record) + '\n'
+        if output == 'emf':
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        else:
+            with open(output, 'a') as f:
+                f.write(line)
+
+
+@contextmanager
+def profiled(path, top=50):
+    # opt-in cProfile dump to path, plus the top allocation sites still
+    # alive at the end of the run in path + '.memory.txt'
+    if not path:
+        yield
+        return
+    import cProfile
+    import tracemalloc
+
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        with open(path + '.memory.txt', 'w') as f:
+            f.write('peak traced memory: %d bytes\n' % peak)
+            for stat in snapshot.statistics('lineno')[:top]:
+                f.write('%s\n' % stat)
@@ -0,0 +1,55 @@
+# Optional Parquet output for the reports.
+#
+# Rows are the same dicts the JSON/CSV writers take; columns are
+# (name, athena type) pairs so they line up with the setup_athena scripts.
+# pyarrow is imported lazily so bundles that only write JSON/CSV don't
+# need it.
+
+from datetime import datetime
+
+HIVE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def arrow_type(pa, athena_type):
+    return {
+        'string': pa.string(),
+        'int': pa.int32(),
+        'bigint': pa.int64(),
+        'float': pa.float32(),
+        'double': pa.float64(),
+        'boolean': pa.bool_(),
+        'timestamp': pa.timestamp('ms'),
+    }[athena_type]
+
+
+def arrow_schema(columns):
+    import pyarrow as pa
+
+    return pa.schema([(name, arrow_type(pa, t)) for name, t in columns])
+
+
+def to_arrow_value(value, athena_type):
+    # the JSON writers already format timestamps for the hive SerDe
+    if athena_type == 'timestamp' and isinstance(value, str):
+        return datetime.strptime(value, HIVE_TIMESTAMP_FORMAT)
+    return value
+
+
+def rows_to_table(rows, columns):
+    import pyarrow as pa
+
+    data = {name: [to_arrow_value(row.get(name), t) for row in rows]
+            for name, t in columns}
+    return pa.Table.from_pydict(data, schema=arrow_schema(columns))
+
+
+def write_parquet(rows, output_path, columns, compression='snappy'):
+    import pyarrow.parquet as pq
+
+    pq.write_table(rows_to_table(rows, columns), output_path,
+                   compression=compression)
+
+
+def partition_key(prefix, day, filename):
+    # hive-style layout read by the partition-projected athena tables
+    return '%sdt=%s/%s' % (prefix, day, filename)
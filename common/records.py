@@ -0,0 +1,59 @@
+# Compact records of API data.
+#
+# Reports that hold API payloads for a whole run keep only the fields they
+# emit, in classes with __slots__, rather than the payloads' dicts of dicts.
+# Strings repeated across records (service and component names, impacts)
+# are shared through an Interner, and long text is spilled to a TextStore on
+# local disk and only read back when the day it belongs to is written.
+
+import os
+import threading
+
+
+class Interner:
+    # returns one shared instance of each equal (hashable) value
+    def __init__(self):
+        self._values = {}
+
+    def __call__(self, value):
+        return self._values.setdefault(value, value)
+
+
+class TextStore:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w+b')
+        # key -> (offset, length) in the file
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def put(self, key, text):
+        data = text.encode('utf-8')
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._index[key] = (self._file.tell(), len(data))
+            self._file.write(data)
+
+    def get(self, key, default=None):
+        if key not in self._index:
+            return default
+        offset, length = self._index[key]
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length).decode('utf-8')
+
+    def close(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
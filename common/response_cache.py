@@ -0,0 +1,141 @@
+# Persistent cache for API responses that rarely change.
+#
+# Entries hold a JSON-serialisable value plus the ETag/Last-Modified it was
+# served with, so stale entries can be revalidated with a conditional
+# request instead of refetched. A ttl of None never expires, for data that
+# can no longer change (e.g. incidents resolved before the edit window).
+#
+# Two backends: SQLite on local disk (survives warm lambda invocations and
+# local runs), or objects in S3 (survive cold starts).
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class Entry:
+    __slots__ = ('value', 'stored_at', 'etag', 'last_modified')
+
+    def __init__(self, value, stored_at, etag=None, last_modified=None):
+        self.value = value
+        self.stored_at = stored_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self, ttl):
+        return ttl is None or time.time() - self.stored_at < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class SQLiteBackend:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'key TEXT PRIMARY KEY, value TEXT, stored_at REAL, '
+                        'etag TEXT, last_modified TEXT)')
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT value, stored_at, etag, last_modified '
+                                  'FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return Entry(json.loads(row[0]), row[1], row[2], row[3])
+
+    def put(self, key, entry):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                            (key, json.dumps(entry.value), entry.stored_at,
+                             entry.etag, entry.last_modified))
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+class S3Backend:
+    # one small object per entry under prefix, read from S3 on every get so
+    # a warm container doesn't keep entries it has finished with
+    def __init__(self, uploader, prefix):
+        self.uploader = uploader
+        self.prefix = prefix
+
+    def object_key(self, key):
+        return '%s%s.json' % (self.prefix, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        body = self.uploader.read_object(self.object_key(key))
+        return Entry(**json.loads(body)) if body else None
+
+    def put(self, key, entry):
+        data = {name: getattr(entry, name) for name in Entry.__slots__}
+        self.uploader.write_object(self.object_key(key), json.dumps(data))
+
+    def close(self):
+        pass
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def put(self, key, entry):
+        pass
+
+    def close(self):
+        pass
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def put(self, key, value, etag=None, last_modified=None):
+        self.backend.put(key, Entry(value, time.time(), etag, last_modified))
+        return value
+
+    def touch(self, key, entry):
+        # a 304 means the cached value is good for another ttl
+        entry.stored_at = time.time()
+        self.backend.put(key, entry)
+        return entry.value
+
+    def fetch(self, key, ttl, load):
+        # for sources without conditional requests: refetch once stale
+        entry = self.get(key)
+        if entry is not None and entry.is_fresh(ttl):
+            return entry.value
+        return self.put(key, load())
+
+    def close(self):
+        self.backend.close()
+
+
+def open_cache(backend, path=None, uploader=None, prefix=None):
+    # backend is 'sqlite' (path), 's3' (uploader and prefix) or None to disable
+    if backend == 'sqlite':
+        return ResponseCache(SQLiteBackend(path))
+    if backend == 's3':
+        return ResponseCache(S3Backend(uploader, prefix))
+    if backend is None:
+        return ResponseCache(NullBackend())
+    raise ValueError('unknown cache backend: %s' % backend)
+
+
+def open_report_cache(settings, uploader):
+    # with a report's CACHE_* settings
+    return open_cache(settings.CACHE_BACKEND, settings.CACHE_PATH, uploader,
+                      settings.CACHE_PREFIX)
@@ -0,0 +1,123 @@
+# Weekly and monthly rollups of the report rows.
+#
+# As rows are written, each day is summarised into mergeable partials (sums
+# and counts per group). The partials of every day in a period are kept in a
+# small state object per period, and each flush rewrites the rollup file of
+# the periods whose days changed. A regenerated day replaces its old partial,
+# so a rollup always matches the day files it was built from. Rollups are JSON
+# lines under <name>_weekly/ and <name>_monthly/, one file per period start.
+
+from datetime import datetime, timedelta
+import collections
+import json
+import threading
+
+PERIODS = ('weekly', 'monthly')
+
+
+def period_start(day, period):
+    # weeks start on monday
+    day = datetime.strptime(day, '%Y-%m-%d').date()
+    if period == 'weekly':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    return day.replace(day=1).isoformat()
+
+
+class Rollup:
+    # metrics are (column, aggregate, field): 'count' counts rows, 'sum'
+    # adds up field, 'mean' averages field over rows where it isn't None.
+    # field is a row key or a function of the row.
+    def __init__(self, name, keys, metrics):
+        self.name = name
+        self.keys = keys
+        self.metrics = metrics
+
+    def value(self, row, field):
+        return field(row) if callable(field) else row.get(field)
+
+    def add(self, partial, row):
+        group = partial.setdefault(json.dumps([row.get(key) for key in self.keys]), {})
+        for column, aggregate, field in self.metrics:
+            total = group.setdefault(column, [0, 0])
+            value = 1 if aggregate == 'count' else self.value(row, field)
+            if value is not None:
+                total[0] += value
+                total[1] += 1
+
+    def rows(self, start, partials):
+        # merges the days' partials into one row per group
+        merged = collections.defaultdict(lambda: collections.defaultdict(lambda: [0, 0]))
+        for partial in partials:
+            for group, totals in partial.items():
+                for column, (total, count) in totals.items():
+                    merged[group][column][0] += total
+                    merged[group][column][1] += count
+        for group in sorted(merged):
+            row = {'period_start': start}
+            row.update(zip(self.keys, json.loads(group)))
+            for column, aggregate, _ in self.metrics:
+                total, count = merged[group][column]
+                if aggregate == 'mean':
+                    row[column] = total / count if count else None
+                else:
+                    row[column] = total
+            yield row
+
+
+class Rollups:
+    def __init__(self, rollups, state_prefix):
+        self.rollups = rollups
+        self.state_prefix = state_prefix
+        # (rollup name, day) -> partial, for days not flushed yet
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    def new_partials(self):
+        return {rollup.name: {} for rollup in self.rollups}
+
+    def add(self, partials, row):
+        for rollup in self.rollups:
+            rollup.add(partials[rollup.name], row)
+
+    def observe(self, rows, partials, day_of):
+        # passes rows through, summarising each into partials[day_of(row)]
+        for row in rows:
+            self.add(partials[day_of(row)], row)
+            yield row
+
+    def set_days(self, partials):
+        # once the days' files are uploaded, so rollups never get ahead of them
+        with self._lock:
+            for day, day_partials in partials.items():
+                for name, partial in day_partials.items():
+                    self.pending[name, day] = partial
+
+    def state_key(self, name, period, start):
+        return '%s%s_%s/%s.json' % (self.state_prefix, name, period, start)
+
+    def flush(self, uploader):
+        # rewrites the state and rollup file of every period with new days;
+        # returns the number of rollup files written
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        touched = collections.defaultdict(dict)
+        for (name, day), partial in pending.items():
+            for period in PERIODS:
+                touched[name, period, period_start(day, period)][day] = partial
+        by_name = {rollup.name: rollup for rollup in self.rollups}
+        for (name, period, start), days in sorted(touched.items()):
+            key = self.state_key(name, period, start)
+            body = uploader.read_object(key)
+            state = json.loads(body) if body else {}
+            state.update(days)
+            uploader.write_object(key, json.dumps(state, sort_keys=True))
+            lines = ''.join('%s\n' % json.dumps(row)
+                            for row in by_name[name].rows(start, state.values()))
+            uploader.write_object('%s_%s/%s.json' % (name, period, start), lines)
+        return len(touched)
+
+
+def flush_rollups(rollups, uploader, metrics):
+    # before days are checkpointed, so a resumed run's rollups include them
+    with metrics.stage('rollups'):
+        metrics.count('rollup_files', rollups.flush(uploader))
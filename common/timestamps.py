@@ -0,0 +1,36 @@
+# Fast parsing for the fixed-format UTC timestamps the APIs return.
+#
+# PagerDuty sends 'YYYY-MM-DDTHH:MM:SSZ' and Statuspage adds milliseconds
+# ('YYYY-MM-DDTHH:MM:SS.fffZ'). Slicing the fields out is several times
+# faster than strptime, and since the same created_at/resolved_at strings
+# are read repeatedly per incident, results are cached by value.
+#
+# Records held for a whole run store times as epoch milliseconds instead.
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+
+@lru_cache(maxsize=65536)
+def parse_timestamp(value):
+    if len(value) < 20 or value[-1] != 'Z' or value[4] != '-' or value[10] != 'T':
+        raise ValueError('unsupported timestamp: %r' % value)
+    microsecond = 0
+    if value[19] == '.':
+        microsecond = int(value[20:-1][:6].ljust(6, '0'))
+    elif len(value) != 20:
+        raise ValueError('unsupported timestamp: %r' % value)
+    return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                    microsecond, tzinfo=timezone.utc)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def epoch_ms(value):
+    return (parse_timestamp(value) - EPOCH) // timedelta(milliseconds=1)
+
+
+def from_epoch_ms(ms):
+    return EPOCH + timedelta(milliseconds=ms)
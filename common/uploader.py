@@ -0,0 +1,196 @@
+# Shared S3 uploader for the report lambdas.
+#
+# One boto3 client (and connection pool) is reused for every file, uploads
+# run concurrently on a thread pool, and files whose MD5 already matches the
+# ETag of the object in S3 are skipped, since most regenerated days are
+# byte-for-byte identical to what was uploaded last run. boto3 is only
+# imported when a real client is made, since loading it (and botocore's
+# service models) is a large part of a cold start.
+#
+# Without s3:ListBucket, S3 answers a read of a missing key with AccessDenied
+# rather than NoSuchKey, and listing fails outright. Both are treated as
+# nothing being there (with a warning), so a role that can only put objects
+# still gets every file uploaded, and state the reports keep in S3 (manifests,
+# cursors) starts over rather than failing the run. A dry run does every read
+# but only prints the uploads, writes and deletes it would make (multipart
+# uploads aside).
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_access_denied(error):
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') == 'AccessDenied'
+
+
+def make_client(max_connections):
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client('s3', config=Config(max_pool_connections=max_connections))
+
+
+class S3Uploader:
+    def __init__(self, bucket, max_workers=8, skip_unchanged=True, client=None, dry_run=False):
+        self.bucket = bucket
+        self.skip_unchanged = skip_unchanged
+        self.dry_run = dry_run
+        # client can be swapped out, e.g. for bench/'s local stand-in, or
+        # shared between uploaders
+        self.client = client or make_client(max_workers)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+        self.uploaded = []
+        self.skipped = []
+        self._etags = {}
+        self._listed_prefixes = set()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _remote_etag(self, key):
+        # list each prefix once rather than issuing a HEAD per key
+        prefix = key.rsplit('/', 1)[0] + '/' if '/' in key else key
+        with self._lock:
+            if prefix not in self._listed_prefixes:
+                try:
+                    paginator = self.client.get_paginator('list_objects_v2')
+                    for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                        for obj in page.get('Contents', []):
+                            self._etags[obj['Key']] = obj['ETag'].strip('"')
+                except Exception as e:
+                    if not is_access_denied(e):
+                        raise
+                    print('no s3:ListBucket on %s, uploading %s* unconditionally' % (self.bucket, prefix))
+                self._listed_prefixes.add(prefix)
+        return self._etags.get(key)
+
+    def _upload(self, path, key):
+        # multipart uploads have a non-MD5 ETag and simply never match
+        if self.skip_unchanged and file_md5(path) == self._remote_etag(key):
+            self.skipped.append(key)
+            return False
+        if self.dry_run:
+            print('would upload %s to %s' % (path, key))
+            return False
+        self.client.upload_file(path, self.bucket, key)
+        self.uploaded.append(key)
+        return True
+
+    def multipart(self, key):
+        return MultipartUpload(self, key)
+
+    def submit(self, path, key):
+        future = self.executor.submit(self._upload, path, key)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        futures, self.futures = self.futures, []
+        # re-raise the first failure, if any
+        return [f.result() for f in futures]
+
+    def upload_all(self, files):
+        for path, key in files:
+            self.submit(path, key)
+        return self.wait()
+
+    # small state objects (manifests etc.) that live next to the reports
+    def read_object(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            if is_access_denied(e):
+                print('access denied reading %s, treating it as missing' % key)
+                return None
+            raise
+        return obj['Body'].read()
+
+    def write_object(self, key, body):
+        if self.dry_run:
+            print('would write %s' % key)
+            return
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+
+    def delete_object(self, key):
+        if self.dry_run:
+            print('would delete %s' % key)
+            return
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
+
+
+# One object sent as numbered parts, each uploaded on the uploader's pool as
+# soon as it's written (see jsonl.JSONLinesWriter), and deleted locally once
+# it's in. S3 needs every part but the last to be at least 5 MiB. Multipart
+# ETags aren't MD5s, so these objects are always uploaded.
+class MultipartUpload:
+    def __init__(self, uploader, key):
+        self.uploader = uploader
+        self.key = key
+        self.upload_id = None
+        self.futures = []
+
+    @property
+    def started(self):
+        return self.upload_id is not None
+
+    def add_part(self, path):
+        if self.upload_id is None:
+            self.upload_id = self.uploader.client.create_multipart_upload(
+                Bucket=self.uploader.bucket, Key=self.key)['UploadId']
+        number = len(self.futures) + 1
+        self.futures.append(self.uploader.executor.submit(self._upload_part, path, number))
+
+    def _upload_part(self, path, number):
+        with open(path, 'rb') as f:
+            response = self.uploader.client.upload_part(
+                Bucket=self.uploader.bucket, Key=self.key, UploadId=self.upload_id,
+                PartNumber=number, Body=f)
+        os.remove(path)
+        return {'ETag': response['ETag'], 'PartNumber': number}
+
+    def complete(self):
+        try:
+            parts = [f.result() for f in self.futures]
+        except BaseException:
+            self.abort()
+            raise
+        self.uploader.client.complete_multipart_upload(
+            Bucket=self.uploader.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': parts})
+        self.uploader.uploaded.append(self.key)
+
+    def abort(self):
+        if self.upload_id is None:
+            return
+        # let parts in flight finish first, or they'd outlive the abort
+        for future in self.futures:
+            future.exception()
+        self.uploader.client.abort_multipart_upload(
+            Bucket=self.uploader.bucket, Key=self.key, UploadId=self.upload_id)
+        self.upload_id = None
@@ -3,55 +3,392 @@
 
 import settings
 
-from datetime import datetime, timedelta
+from checkpoint import Deadline, open_report_checkpoint, resumable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
 from functools import lru_cache
+from jsonl import JSONLinesWriter
+from metrics import Metrics, profiled
 from os import path
-from pytz import timezone
-import boto3
+from parquet_output import partition_key, write_parquet
+from records import Interner
+from response_cache import open_report_cache
+from rollups import Rollup, Rollups, flush_rollups
+from timestamps import epoch_ms, from_epoch_ms
+from uploader import S3Uploader
+import calendar
+import collections
+import hashlib
 import json
-import pypd
+import re
+import sys
+import threading
+import time
+
+BASE_URL = 'https://api.pagerduty.com'
+# the most items a page of the api holds
+PAGE_LIMIT = 100
+
+# column types, matching the table setup_athena.py creates
+REPORT_COLUMNS = [
+    ('id', 'string'),
+    ('title', 'string'),
+    ('urgency', 'string'),
+    ('escalation_policy', 'string'),
+    ('service', 'string'),
+    ('created_at', 'timestamp'),
+    ('time_to_acknowledge', 'int'),
+    ('time_to_resolve', 'int'),
+    ('num_acknowledgments', 'int'),
+    ('num_users_notified', 'int'),
+    ('user', 'string'),
+    ('out_of_hours', 'boolean'),
+]
+
+metrics = Metrics()
+intern = Interner()
+
+# weekly and monthly summaries for the dashboards
+rollups = Rollups([
+    Rollup('incidents_response', ['service', 'escalation_policy'], [
+        ('incidents', 'count', None),
+        ('mean_time_to_acknowledge', 'mean', 'time_to_acknowledge'),
+        ('mean_time_to_resolve', 'mean', 'time_to_resolve'),
+    ]),
+    Rollup('incidents_users', ['user'], [
+        ('incidents', 'count', None),
+        ('out_of_hours', 'sum', 'out_of_hours'),
+    ]),
+], settings.ROLLUP_STATE_PREFIX)
+
+
+@lru_cache(maxsize=1)
+def get_session():
+    # one pooled session for every thread; requests is only imported once
+    # there's something to fetch, so call this before starting threads
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=settings.BACKFILL_WORKERS + settings.LOG_ENTRY_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Authorization'] = 'Token token=%s' % settings.API_KEY
+    session.headers['Accept'] = 'application/vnd.pagerduty+json;version=2'
+    session.hooks['response'].append(count_response)
+    return session
+
+
+def count_response(r, *args, **kwargs):
+    metrics.count('requests')
+    metrics.count('received_bytes', len(r.content))
+
+
+class Incident:
+    # The parts of a PagerDuty incident the report uses, instead of a pypd
+    # object per incident. created_at is epoch milliseconds, and service and
+    # escalation policy names are shared between incidents.
+    __slots__ = ('id', 'title', 'urgency', 'escalation_policy', 'service',
+                 'created_at', 'status')
+
+    def __init__(self, id, title, urgency, escalation_policy, service, created_at, status):
+        self.id = id
+        self.title = title
+        self.urgency = intern(urgency)
+        self.escalation_policy = intern(escalation_policy)
+        self.service = intern(service)
+        self.created_at = created_at
+        self.status = intern(status)
+
+    @classmethod
+    def from_api(cls, incident):
+        return cls(incident['id'], incident['title'], incident['urgency'],
+                   incident['escalation_policy']['summary'], incident['service']['summary'],
+                   epoch_ms(incident['created_at']), incident['status'])
+
+    # the response cache holds them as lists
+    def to_state(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+
+def find_pages(endpoint, key, **params):
+    # yields the items (under key) of one page of endpoint at a time, so each
+    # can be reduced before the next arrives; list params go as name[]
+    params = {('%s[]' % name if isinstance(value, list) else name): value
+              for name, value in params.items()}
+    offset = 0
+    while True:
+        r = get_session().get('%s/%s' % (BASE_URL, endpoint),
+                              params=dict(params, offset=offset, limit=PAGE_LIMIT))
+        r.raise_for_status()
+        response = r.json()
+        yield response[key]
+        more = response.get('more')
+        if more is None:
+            total = response.get('total')
+            more = total is not None and offset + PAGE_LIMIT < total
+        if not more:
+            return
+        offset += PAGE_LIMIT
+        # the api won't page past MAX_PAGINATION_OFFSET, so the rest of the
+        # results would be lost without a word
+        if offset + PAGE_LIMIT > settings.MAX_PAGINATION_OFFSET:
+            raise RuntimeError('more than %d results from /%s for %r' % (
+                settings.MAX_PAGINATION_OFFSET, endpoint, params))
+
 
 def timerange_for_report():
     days = settings.DAYS_BACK
-    today = settings.END_DATE
+    today = date.today()
     start_day = today - timedelta(days=days)
     until = today.strftime('%Y-%m-%d')
     since = start_day.strftime('%Y-%m-%d')
     return (since, until)
 
 
-def get_incidents(since, until):
-    incidents = pypd.Incident.find(since=since, until=until, time_zone='UTC')
-    return incidents
+def window_is_settled(until):
+    settled_until = date.today() - timedelta(days=settings.EDIT_WINDOW_DAYS)
+    return datetime.strptime(until, '%Y-%m-%d').date() <= settled_until
+
+
+def all_resolved(incidents):
+    return all(incident.status == 'resolved' for incident in incidents)
 
 
 @lru_cache(maxsize=1)
-def get_log_entries(incident):
-    log_entries = incident.log_entries(is_overview=False)
-    return log_entries
+def excluded_service_names():
+    # one pass over the service name for all the patterns
+    return re.compile('|'.join(map(re.escape, settings.SERVICE_NAMES_TO_EXCLUDE)))
+
+
+def get_services():
+    return [{'id': service['id'], 'name': service['name']}
+            for page in find_pages('services', 'services') for service in page]
+
+
+def services_as_of(cache, until):
+    # a service list fetched after the window closed has every service that
+    # could have incidents in it
+    key = 'pagerduty:services'
+    closed_at = calendar.timegm(datetime.strptime(until, '%Y-%m-%d').timetuple())
+    entry = cache.get(key)
+    if entry is not None and entry.stored_at >= closed_at:
+        return entry.value
+    services = get_services()
+    cache.put(key, services)
+    return services
+
+
+def incident_filters(cache, until):
+    # excluded services and low urgency incidents are left out of the
+    # incidents query, so they are never fetched. /log_entries has no such
+    # filters: the window-wide query still returns their entries, which are
+    # dropped as they're indexed
+    filters = {}
+    if settings.SERVICE_NAMES_TO_EXCLUDE:
+        with metrics.stage('get_services'):
+            services = services_as_of(cache, until)
+        service_ids = sorted(service['id'] for service in services
+                             if not service_is_excluded(service['name']))
+        # past this many, the query string gets too long for the api; the
+        # incidents are filtered as they come back instead
+        if len(service_ids) <= settings.MAX_SERVICE_IDS_PER_QUERY:
+            filters['service_ids'] = service_ids
+    if settings.EXCLUDE_LOW_URGENCY:
+        filters['urgencies'] = ['high']
+    return filters
+
+
+def get_incidents(cache, since, until):
+    filters = incident_filters(cache, until)
+    if filters.get('service_ids') == []:
+        return []
+    # a settled window of resolved incidents is cached for good, per filter
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:12]
+    key = 'pagerduty:incident_records:%s:%s:%s' % (since, until, digest)
+    settled = window_is_settled(until)
+    if settled:
+        entry = cache.get(key)
+        if entry is not None:
+            return [Incident(*state) for state in entry.value]
+    incidents = [Incident.from_api(incident)
+                 for page in find_pages('incidents', 'incidents', since=since, until=until,
+                                        time_zone='UTC', **filters)
+                 for incident in page]
+    if settled and all_resolved(incidents):
+        cache.put(key, [incident.to_state() for incident in incidents])
+    return incidents
+
+
+def get_log_entry_index(incident):
+    index = LogEntryIndex()
+    for page in find_pages('incidents/%s/log_entries' % incident.id, 'log_entries',
+                           is_overview='false', time_zone='UTC'):
+        index.add_all(page)
+    return index
+
+
+def log_entry_days(since, until):
+    # entries for an incident can land after the report window closes
+    # (e.g. resolved the next morning), so look a few days past it, up to today
+    last = min(datetime.strptime(until, '%Y-%m-%d').date() + timedelta(days=settings.LOG_ENTRY_GRACE_DAYS),
+               datetime.utcnow().date() + timedelta(days=1))
+    return [day for day, _ in backfill_shards(since, last.strftime('%Y-%m-%d'))]
+
+
+def fetch_log_entry_day(day):
+    # every entry of one UTC day (up to now, for today), indexed by incident;
+    # a day at a time keeps each query well inside the api's pagination limit
+    start = datetime.strptime(day, '%Y-%m-%d')
+    end = min(start + timedelta(days=1), datetime.utcnow())
+    indexes = collections.defaultdict(LogEntryIndex)
+    for page in find_pages('log_entries', 'log_entries', since=day, until=end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                           is_overview='false', time_zone='UTC'):
+        for log in page:
+            indexes[log['incident']['id']].add(log)
+    return dict(indexes)
+
+
+class LogEntryDays:
+    # The days of log entries a run has fetched, shared by its shards: the
+    # grace days after one backfill day are the next days of the backfill, so
+    # each is fetched once rather than by every shard that looks at it. Only
+    # the max_days most recently used are kept.
+
+    def __init__(self, max_days):
+        self.max_days = max_days
+        self.days = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, day):
+        with self.lock:
+            future = self.days.get(day)
+            fetching = future is None
+            if fetching:
+                future = self.days[day] = Future()
+                while len(self.days) > self.max_days:
+                    self.days.popitem(last=False)
+            else:
+                self.days.move_to_end(day)
+        if fetching:
+            try:
+                future.set_result(fetch_log_entry_day(day))
+            except BaseException as e:
+                with self.lock:
+                    self.days.pop(day, None)
+                future.set_exception(e)
+        return future.result()
+
+
+def get_log_entry_indexes(cache, log_days, incidents, since, until):
+    key = 'pagerduty:log_entry_indexes:%s:%s' % (since, until)
+    settled = window_is_settled(until) and all_resolved(incidents)
+    if settled:
+        entry = cache.get(key)
+        # a change to the exclusion settings can ask for incidents not cached yet
+        if entry is not None and all(incident.id in entry.value for incident in incidents):
+            return {incident.id: LogEntryIndex.from_state(entry.value[incident.id]) for incident in incidents}
+    indexes = fetch_log_entry_indexes(log_days, incidents, since, until)
+    if settled:
+        cache.put(key, {incident_id: index.to_state() for incident_id, index in indexes.items()})
+    return indexes
+
+
+def fetch_log_entry_indexes(log_days, incidents, since, until):
+    # paged /log_entries queries for the window's days, grouped by incident,
+    # instead of a round trip per incident; both endpoints return entries
+    # most recent first, so going through the days from the last one sees
+    # them in the order LogEntryIndex relies on
+    indexes = {incident.id: LogEntryIndex() for incident in incidents}
+    for day in reversed(log_entry_days(since, until)):
+        day_indexes = log_days.get(day)
+        for incident_id, index in indexes.items():
+            if incident_id in day_indexes:
+                index.extend(day_indexes[incident_id])
+    # anything resolved after the window still needs its own fetch
+    missing = [incident for incident in incidents
+               if incident.status == 'resolved' and 'resolve_log_entry' not in indexes[incident.id].first_at]
+    with ThreadPoolExecutor(max_workers=settings.LOG_ENTRY_WORKERS) as pool:
+        for incident, index in zip(missing, pool.map(get_log_entry_index, missing)):
+            indexes[incident.id] = index
+    return indexes
+
+
+def get_users():
+    return [{'name': user['name'], 'time_zone': user['time_zone']}
+            for page in find_pages('users', 'users') for user in page]
 
 
 @lru_cache(maxsize=1)
-def get_users_timezones():
-    users = pypd.User.find()
+def get_users_timezones(cache):
+    with metrics.stage('get_users'):
+        users = cache.fetch('pagerduty:users', settings.USERS_CACHE_TTL, get_users)
+    from pytz import timezone
     timezone_by_user = {user['name']: timezone(user['time_zone']) for user in users}
     return timezone_by_user
 
 
-def pagerduty_datetime(time_string):
-    naive_time = datetime.strptime(time_string, '%Y-%m-%dT%H:%M:%SZ')
-    utc_time = timezone('UTC').localize(naive_time)
-    return utc_time
-
-
-def first_timestamp_for_type(all_entries, entry_type):
-    relevant_entries = [log['created_at'] for log in all_entries if log['type'] == entry_type]
-    if not relevant_entries:
+class LogEntryIndex:
+    # Everything the report derives from an incident's log entries, built a
+    # page at a time as they're fetched. Entries come from most to least
+    # recent, so the last entry seen of each type is the first
+    # chronologically. Times are epoch milliseconds; only the first time of
+    # each type is kept, as that's all the report reads.
+    __slots__ = ('first_at', 'users_acked', 'users_notified', 'notified')
+
+    def __init__(self, first_at=None, users_acked=None, users_notified=None):
+        self.first_at = first_at or {}
+        # most recent first, like the entries themselves
+        self.users_acked = users_acked or []
+        self.users_notified = users_notified or []
+        self.notified = set(self.users_notified)
+
+    def add(self, log):
+        entry_type = log['type']
+        self.first_at[intern(entry_type)] = epoch_ms(log['created_at'])
+        if entry_type == 'acknowledge_log_entry':
+            self.users_acked.append(intern(log['agent']['summary']))
+        elif entry_type == 'notify_log_entry':
+            user = intern(log['user']['summary'])
+            self.users_notified.append(user)
+            self.notified.add(user)
+
+    def add_all(self, log_entries):
+        for log in log_entries:
+            self.add(log)
+
+    def extend(self, earlier):
+        # as if the entries of an index of earlier ones were added one by one
+        self.first_at.update(earlier.first_at)
+        self.users_acked.extend(earlier.users_acked)
+        self.users_notified.extend(earlier.users_notified)
+        self.notified.update(earlier.notified)
+
+    # the response cache holds them as lists
+    def to_state(self):
+        return [self.first_at, self.users_acked, self.users_notified]
+
+    @classmethod
+    def from_state(cls, state):
+        first_at, users_acked, users_notified = state
+        return cls({intern(entry_type): at for entry_type, at in first_at.items()},
+                   [intern(user) for user in users_acked], [intern(user) for user in users_notified])
+
+    @property
+    def num_users_notified(self):
+        # unique users notified instead of number of notifications sent
+        return len(self.notified)
+
+    @property
+    def user_credited(self):
+        return user_credited_for_incident(self.users_acked, self.users_notified)
+
+
+def first_timestamp_for_type(index, entry_type):
+    first_entry = index.first_at.get(entry_type)
+    if first_entry is None:
         return None
-    # list is ordered from most to least recent, so the first entry chronologically is at the end
-    first_entry = relevant_entries[-1]
-    timestamp = pagerduty_datetime(first_entry)
-    return timestamp
+    return from_epoch_ms(first_entry)
 
 
 def seconds_since_occurred(beginning, end):
@@ -62,14 +399,9 @@ def seconds_since_occurred(beginning, end):
     return seconds
 
 
-def timezone_for_user(user_name):
-    timezone_by_user = get_users_timezones()
-    return timezone_by_user[user_name]
-
-
-def incident_was_out_of_hours(user, incident):
-    user_timezone = timezone_for_user(user)
-    incident_utc_time = pagerduty_datetime(incident['created_at'])
+def incident_was_out_of_hours(user, incident, timezones):
+    user_timezone = timezones[user]
+    incident_utc_time = from_epoch_ms(incident.created_at)
     incident_local_time = incident_utc_time.astimezone(user_timezone)
     # if during the weekend
     if incident_local_time.weekday() > 4:
@@ -88,30 +420,25 @@ def user_credited_for_incident(users_acked, users_notified):
     return users_notified[-1]
 
 
-def service_is_excluded(incident):
-    service_name = incident['service']['summary']
-    for pattern in settings.SERVICE_NAMES_TO_EXCLUDE:
-        if pattern in service_name:
-            return True
-    return False
+def service_is_excluded(service_name):
+    return bool(settings.SERVICE_NAMES_TO_EXCLUDE) and excluded_service_names().search(service_name) is not None
 
 
 def incident_data(incident):
-    return {'id': incident['id'],
-            'title': incident['title'],
-            'urgency': incident['urgency'],
-            'escalation_policy': incident['escalation_policy']['summary'],
-            'service': incident['service']['summary']}
+    return {'id': incident.id,
+            'title': incident.title,
+            'urgency': incident.urgency,
+            'escalation_policy': incident.escalation_policy,
+            'service': incident.service}
 
 
-def time_data(incident):
-    log_entries = get_log_entries(incident)
+def time_data(incident, index):
     # put date in format athena can inteterpet
-    created_at = pagerduty_datetime(incident['created_at'])
+    created_at = from_epoch_ms(incident.created_at)
     # JSON SerDE wants timestamp to be yyyy-mm-dd hh:mm:ss[.fffffffff]
     created_at_formatted = created_at.strftime('%Y-%m-%d %H:%M:%S')
-    acknowledgement_time = first_timestamp_for_type(log_entries, 'acknowledge_log_entry')
-    resolution_time = first_timestamp_for_type(log_entries, 'resolve_log_entry')
+    acknowledgement_time = first_timestamp_for_type(index, 'acknowledge_log_entry')
+    resolution_time = first_timestamp_for_type(index, 'resolve_log_entry')
     time_to_acknowledge = seconds_since_occurred(created_at, acknowledgement_time)
     time_to_resolve = seconds_since_occurred(created_at, resolution_time)
     return {'created_at': created_at_formatted,
@@ -119,57 +446,254 @@ def time_data(incident):
             'time_to_resolve': time_to_resolve}
 
 
-def user_data(incident):
-    log_entries = get_log_entries(incident)
-    users_acked = [log['agent']['summary'] for log in log_entries if log['type'] == 'acknowledge_log_entry']
-    users_notified = [log['user']['summary'] for log in log_entries if log['type'] == 'notify_log_entry']
-    num_acknowledgments = len(users_acked)
-    # use set to dedupe so we get a count of unique users notified instead of number of notifications sent
-    num_users_notified = len(set(users_notified))
-    # notes are in descending chronological order, so first user in the list was the last to be notified
-    user_credited = user_credited_for_incident(users_acked, users_notified)
-    out_of_hours = incident_was_out_of_hours(user_credited, incident)
-    return {'num_acknowledgments': num_acknowledgments,
-            'num_users_notified': num_users_notified,
+def user_data(incident, index, timezones):
+    user_credited = index.user_credited
+    out_of_hours = incident_was_out_of_hours(user_credited, incident, timezones)
+    return {'num_acknowledgments': len(index.users_acked),
+            'num_users_notified': index.num_users_notified,
             'user': user_credited,
             'out_of_hours': out_of_hours}
 
-def generate_report(since, until):
-    incidents = get_incidents(since, until)
-    rows = []
-    for incident in incidents:
-        row = {}
-        if service_is_excluded(incident):
-            continue
-        if incident['urgency'] == 'low' and settings.EXCLUDE_LOW_URGENCY:
-            continue
-        row.update(incident_data(incident))
-        row.update(time_data(incident))
-        row.update(user_data(incident))
-        rows.append(row)
-    return rows
+def generate_report(cache, log_days, since, until):
+    incidents = []
+    with metrics.stage('get_incidents'):
+        for incident in get_incidents(cache, since, until):
+            # already left out by the query, unless there were too many services
+            if service_is_excluded(incident.service):
+                continue
+            if incident.urgency == 'low' and settings.EXCLUDE_LOW_URGENCY:
+                continue
+            incidents.append(incident)
+    metrics.count('incidents', len(incidents))
+    with metrics.stage('get_log_entries'):
+        indexes_by_incident = get_log_entry_indexes(cache, log_days, incidents, since, until)
+    # rows are generated as the writer consumes them
+    return generate_rows(incidents, indexes_by_incident, get_users_timezones(cache))
 
 
-def write_report(rows, output_path):
-    with open(output_path, 'w') as f:
-        for row in rows:
-            # JSON SerDe wants one object per line
-            f.write("%s\n" % json.dumps(row))
-
-def upload_report(output_path):
-    s3_name = "%s%s" % (settings.S3_PREFIX, path.basename(output_path))
-    s3 = boto3.client('s3')
-    s3.upload_file(output_path, settings.S3_BUCKET, s3_name)
+@lru_cache(maxsize=1)
+def batch_modules_installed():
+    # numpy and pandas aren't in requirements.txt, as they'd outgrow the lambda
+    # bundle, so the batched path only runs where they've been added
+    try:
+        import numpy  # noqa: F401
+        import pandas  # noqa: F401
+    except ImportError:
+        print('numpy/pandas not installed; batches of %d+ incidents use the '
+              'per-incident path' % settings.BATCH_THRESHOLD)
+        return False
+    return True
+
+
+def generate_rows(incidents, indexes_by_incident, timezones):
+    indexes = [indexes_by_incident.pop(incident.id) for incident in incidents]
+    if len(incidents) >= settings.BATCH_THRESHOLD:
+        if batch_modules_installed():
+            yield from generate_rows_batched(incidents, indexes, timezones)
+            return
+        metrics.count('batch_fallbacks')
+    for incident, index in zip(incidents, indexes):
+        row = {}
+        row.update(incident_data(incident))
+        row.update(time_data(incident, index))
+        row.update(user_data(incident, index, timezones))
+        yield row
+
+
+def generate_rows_batched(incidents, indexes, timezones):
+    # Array version of the per-incident time_data/user_data path for big
+    # batches: timestamps are differenced with numpy, and converted to each
+    # credited user's timezone (one conversion per timezone) with pandas.
+    # Produces the same rows as the scalar path.
+    import numpy as np
+    import pandas as pd
+
+    first_acks = [index.first_at.get('acknowledge_log_entry') for index in indexes]
+    first_resolves = [index.first_at.get('resolve_log_entry') for index in indexes]
+    users = [index.user_credited for index in indexes]
+    created = np.array([incident.created_at for incident in incidents], dtype='datetime64[ms]')
+
+    def seconds_since_created(times):
+        # missing entries come through as NaT
+        times = np.array([time if time is not None else 'NaT' for time in times],
+                         dtype='datetime64[ms]')
+        seconds = np.round((times - created).astype('int64') / 1000)
+        return [None if missing else int(s)
+                for s, missing in zip(seconds, np.isnat(times))]
+
+    time_to_acknowledge = seconds_since_created(first_acks)
+    time_to_resolve = seconds_since_created(first_resolves)
+
+    out_of_hours = np.zeros(len(incidents), dtype=bool)
+    created_utc = pd.DatetimeIndex(created).tz_localize('UTC')
+    # JSON SerDE wants timestamp to be yyyy-mm-dd hh:mm:ss[.fffffffff]
+    created_at = [timestamp.replace('T', ' ') for timestamp in
+                  np.datetime_as_string(created.astype('datetime64[s]'))]
+    zones = pd.Series([timezones[user].zone for user in users])
+    for zone, positions in zones.groupby(zones).groups.items():
+        local = created_utc[positions].tz_convert(zone)
+        out_of_hours[positions] = ((local.weekday > 4) |
+                                   (local.hour < settings.START_OF_DAY) |
+                                   (local.hour >= settings.END_OF_DAY))
+
+    for n, incident in enumerate(incidents):
+        row = incident_data(incident)
+        row.update({'created_at': created_at[n],
+                    'time_to_acknowledge': time_to_acknowledge[n],
+                    'time_to_resolve': time_to_resolve[n],
+                    'num_acknowledgments': len(indexes[n].users_acked),
+                    'num_users_notified': indexes[n].num_users_notified,
+                    'user': users[n],
+                    'out_of_hours': bool(out_of_hours[n])})
+        yield row
+
+
+def report_key(output_path, day):
+    if settings.OUTPUT_FORMAT == 'parquet':
+        return partition_key(settings.S3_PARQUET_PREFIX, day, path.basename(output_path))
+    return "%s%s" % (settings.S3_PREFIX, path.basename(output_path))
+
+
+def write_report(rows, output_path, stream=None):
+    # returns the number of rows written
+    if settings.OUTPUT_FORMAT == 'parquet':
+        rows = list(rows)
+        write_parquet(rows, output_path, REPORT_COLUMNS)
+        return len(rows)
+    # JSON SerDe wants one object per line; big days go out in parts as
+    # they're written when there's a multipart upload to take them
+    with JSONLinesWriter(output_path, settings.OUTPUT_PART_BYTES if stream else None,
+                         stream.add_part if stream else None,
+                         settings.WRITE_BUFFER_SIZE) as writer:
+        writer.writerows(rows)
+    return writer.rows
+
+
+def rows_in_window(rows, days):
+    # the api also returns incidents created right at the end of the window,
+    # which belong to the next one (and its day file and rollups)
+    for row in rows:
+        if row['created_at'][:10] in days:
+            yield row
+        else:
+            metrics.count('rows_outside_window')
+
+
+def run_report(uploader, cache, log_days, since, until):
+    output_path = '/tmp/%s.%s' % (since, settings.OUTPUT_FORMAT)
+    stream = uploader.multipart(report_key(output_path, since))
+    # every day of the window is replaced, including any that lost their rows
+    partials = {day: rollups.new_partials() for day, _ in backfill_shards(since, until)}
+    rows = rollups.observe(rows_in_window(generate_report(cache, log_days, since, until), partials),
+                           partials, lambda row: row['created_at'][:10])
+    try:
+        # rows are generated as they're written, so the two are timed together
+        with metrics.stage('generate_and_write'):
+            metrics.count('rows', write_report(rows, output_path, stream))
+    except BaseException:
+        stream.abort()
+        raise
+    # a day only counts as done for the checkpoint once it's in S3
+    if stream.started:
+        stream.complete()
+    else:
+        uploader.submit(output_path, report_key(output_path, since)).result()
+    rollups.set_days(partials)
+    return since
+
+
+def backfill_shards(start, end):
+    # one (since, until) pair per day, end exclusive
+    day = datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.strptime(end, '%Y-%m-%d').date()
+    while day < last:
+        yield day.strftime('%Y-%m-%d'), (day + timedelta(days=1)).strftime('%Y-%m-%d')
+        day += timedelta(days=1)
+
+
+def wait_for_uploads(uploader):
+    # uploads overlap report generation, so this is only the time left waiting
+    with metrics.stage('upload_wait'):
+        uploader.wait()
+    metrics.count('files_uploaded', len(uploader.uploaded))
+    metrics.count('files_unchanged', len(uploader.skipped))
+
+
+def run_shards(shards, checkpoint, deadline, uploader, cache):
+    # days already uploaded by an earlier attempt at this job are skipped
+    done = checkpoint.state.setdefault('days', [])
+    last_saved = time.monotonic()
+
+    def commit_rollups():
+        if settings.ROLLUPS:
+            flush_rollups(rollups, uploader, metrics)
+
+    def record(futures, raise_errors=True):
+        nonlocal last_saved
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        done.extend(f.result() for f in futures if f.exception() is None)
+        if time.monotonic() - last_saved >= settings.CHECKPOINT_INTERVAL:
+            commit_rollups()
+            checkpoint.save()
+            last_saved = time.monotonic()
+        if errors and raise_errors:
+            raise errors[0]
+
+    get_session()
+    # warm the shared timezone cache once rather than racing in every worker
+    get_users_timezones(cache)
+    # enough days for the shards in flight and the grace days after them
+    log_days = LogEntryDays(settings.BACKFILL_WORKERS + settings.LOG_ENTRY_GRACE_DAYS + 1)
+    with ThreadPoolExecutor(max_workers=settings.BACKFILL_WORKERS) as pool:
+        # only BACKFILL_WORKERS days are held in memory at once
+        pending = set()
+        try:
+            for since, until in shards:
+                if since in done:
+                    metrics.count('days_resumed')
+                    continue
+                deadline.check()
+                pending.add(pool.submit(run_report, uploader, cache, log_days, since, until))
+                if len(pending) >= settings.BACKFILL_WORKERS:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    record(finished)
+        except BaseException:
+            # days already started still finish, and are kept
+            record(wait(pending)[0], raise_errors=False)
+            commit_rollups()
+            raise
+        record(wait(pending)[0])
+    commit_rollups()
+    wait_for_uploads(uploader)
 
 
 def lambda_handler(event, context):
-    pypd.api_key = settings.API_KEY
-    since, until = timerange_for_report()
-    output_path = '/tmp/%s.json' % since
-    rows = generate_report(since, until)
-    write_report(rows, output_path)
-    upload_report(output_path)
+    # event may hold {'backfill': {'start': ..., 'end': ...}} and/or {'profile': path}
+    event = event or {}
+    if 'backfill' in event:
+        start, end = event['backfill']['start'], event['backfill']['end']
+        shards = list(backfill_shards(start, end))
+        job = {'backfill': [start, end]}
+    else:
+        shards = [timerange_for_report()]
+        job = {'window': list(shards[0])}
+    # one uploader (and S3 client) for everything the run reads and writes
+    with S3Uploader(settings.S3_BUCKET, max_workers=settings.UPLOAD_WORKERS) as uploader:
+        checkpoint = open_report_checkpoint(settings, job, uploader)
+        cache = open_report_cache(settings, uploader)
+        deadline = Deadline(context, settings.CHAIN_MARGIN_SECONDS)
+        try:
+            with profiled(event.get('profile') or settings.PROFILE_PATH), metrics.stage('total'):
+                with resumable(checkpoint, event, context, settings.MAX_CHAINED_RUNS):
+                    run_shards(shards, checkpoint, deadline, uploader, cache)
+        finally:
+            cache.close()
+            metrics.flush(settings.METRICS_OUTPUT, settings.METRICS_NAMESPACE, {'Report': 'incident'})
 
 
 if __name__ == '__main__':
-    lambda_handler(None, None)
+    # incident_report.py [START END] to backfill days START (inclusive) to END (exclusive)
+    if len(sys.argv) == 3:
+        lambda_handler({'backfill': {'start': sys.argv[1], 'end': sys.argv[2]}}, None)
+    else:
+        lambda_handler(None, None)
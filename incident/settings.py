@@ -1,14 +1,33 @@
 import os
-from datetime import date
 
 # credential for pagerduty v2 api
 API_KEY = os.environ['API_KEY']
 # s3 url to upload report into
 S3_BUCKET = os.environ['S3_BUCKET']
 S3_PREFIX = 'incidents/'
-# when to anchor report and how far back to run it
-END_DATE = date.today()
+# 'json', or 'parquet' (needs pyarrow) to write date partitions under S3_PARQUET_PREFIX
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'json')
+S3_PARQUET_PREFIX = 'incidents_parquet/'
+# JSON output bigger than this is uploaded as a multipart object, one part at
+# a time as it's written (S3 parts must be at least 5 MiB)
+OUTPUT_PART_BYTES = 64 * 1024 * 1024
+WRITE_BUFFER_SIZE = 1024 * 1024
+# maintain weekly and monthly rollups (incidents_response_*, incidents_users_*)
+# of the rows as days are written; the partial sums they're built from are kept
+# under ROLLUP_STATE_PREFIX in S3_BUCKET
+ROLLUPS = True
+ROLLUP_STATE_PREFIX = 'manifests/rollups/'
+# number of files uploaded to s3 concurrently
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 8))
+# how many days before today (as of each run) to report on
 DAYS_BACK = 1
+# days processed in parallel when backfilling a date range
+BACKFILL_WORKERS = 4
+# days with at least this many incidents compute time/user fields with
+# numpy/pandas; output is identical to the per-incident path. They aren't in
+# requirements.txt, so add them to the bundle to use it: without them those
+# days are counted as batch_fallbacks and take the per-incident path.
+BATCH_THRESHOLD = 5000
 # start and end of day in local time zone for determining out of hours
 START_OF_DAY = 9
 END_OF_DAY = 17
@@ -16,3 +35,45 @@ END_OF_DAY = 17
 SERVICE_NAMES_TO_EXCLUDE = ['Out of hours', 'Remote access monitoring', 'Fraud Auth Service']
 # set to true to only report on high urgency incidents
 EXCLUDE_LOW_URGENCY = True
+# the incidents query names the services to report on, unless there are more than this
+MAX_SERVICE_IDS_PER_QUERY = 100
+# the api stops paging a query at this many results; a query with more fails
+# rather than losing the rest (log entries are fetched a day at a time)
+MAX_PAGINATION_OFFSET = 10000
+# how far past the report window to look for log entries of its incidents
+LOG_ENTRY_GRACE_DAYS = 2
+# concurrent per-incident log entry fetches for incidents resolved after that
+LOG_ENTRY_WORKERS = 8
+# report windows that closed more than this many days ago won't change any more
+# (once their incidents are all resolved), so their api responses are cached for good
+EDIT_WINDOW_DAYS = 7
+# cache for users, services and settled report windows between runs: off by
+# default (''), 's3' (objects under CACHE_PREFIX in S3_BUCKET) or 'sqlite' (at
+# CACHE_PATH, so only across warm starts); worth turning on for backfills
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or None
+CACHE_PATH = '/tmp/incident_cache.sqlite'
+CACHE_PREFIX = 'cache/incident/'
+# seconds the cached user list (for time zones) is used before refetching it
+USERS_CACHE_TTL = 86400
+
+# incidents, rows, days resumed, files uploaded and time per stage, as 'emf'
+# lines on stdout for CloudWatch, appended to a path, or '' for none
+METRICS_OUTPUT = os.environ.get('METRICS_OUTPUT', 'emf')
+METRICS_NAMESPACE = 'MonitoringReports'
+# cProfile dump (and top allocations) of every run; an event can ask for one
+# run's with {"profile": path}, e.g. for a slow backfill
+PROFILE_PATH = os.environ.get('PROFILE_PATH') or None
+
+# the days of the window or backfill already uploaded are listed in a
+# checkpoint, and skipped when a failed or chained run picks the job up again.
+# It's off by default (''), a file at CHECKPOINT_PATH ('file') or an object at
+# CHECKPOINT_KEY in S3_BUCKET ('s3', which needs the extra S3 permissions
+# listed in the README); on lambda, a run down to
+# CHAIN_MARGIN_SECONDS re-invokes itself, up to MAX_CHAINED_RUNS times in a row
+CHECKPOINT_BACKEND = os.environ.get('CHECKPOINT_BACKEND') or None
+CHECKPOINT_KEY = 'manifests/incident_checkpoint.json'
+CHECKPOINT_PATH = '/tmp/incident_checkpoint.json'
+# seconds between checkpoint saves while a run is going
+CHECKPOINT_INTERVAL = 60
+CHAIN_MARGIN_SECONDS = 120
+MAX_CHAINED_RUNS = 20
@@ -1,107 +1,861 @@
 #!/usr/bin/env python3
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import asyncio
+import collections
 import csv
+import gzip
+import io
+import json
 import os
-import glob
-
-import boto3
-import aiohttp
+import random
+import re
+import sys
+import time
 
+from checkpoint import Deadline, open_report_checkpoint, resumable
+from metrics import Metrics, profiled
+from parquet_output import partition_key, rows_to_table
+from response_cache import open_report_cache
+from rollups import Rollup, Rollups, flush_rollups
+from uploader import S3Uploader
 import settings
 
 BASE_URL = "https://api.pingdom.com/api/3.1"
 
+# e.g. "Remaining: 394 Time until reset: 3589"
+REQ_LIMIT_RE = re.compile(r"Remaining:\s*(\d+)\s*Time until reset:\s*(\d+)")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+metrics = Metrics()
+
+# weekly and monthly downtime per check, for the dashboards; outages count
+# towards the day they started on, like the day files
+rollups = Rollups(
+    [
+        Rollup(
+            "pingdom_outages",
+            ["check_id", "service"],
+            [
+                ("outages", "sum", lambda row: row["status"] == "down"),
+                (
+                    "down_seconds",
+                    "sum",
+                    lambda row: row["timeto"] - row["timefrom"]
+                    if row["status"] == "down"
+                    else 0,
+                ),
+            ],
+        ),
+    ],
+    settings.ROLLUP_STATE_PREFIX,
+)
+
+# column types of the outage rows, for the parquet table in setup_athena.py
+REPORT_COLUMNS = [
+    ("check_id", "bigint"),
+    ("service", "string"),
+    ("timefrom", "bigint"),
+    ("timeto", "bigint"),
+    ("status", "string"),
+    ("tags", "string"),
+]
+
+
+# Token bucket whose rate is re-synced from Pingdom's Req-Limit-* headers.
+# Pingdom reports a short and a long window; whichever allows the lower
+# sustained rate wins, so we never drain faster than the API refills.
+class RateLimiter:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def update_from_headers(self, headers):
+        limits = []
+        for name in ("Req-Limit-Short", "Req-Limit-Long"):
+            match = REQ_LIMIT_RE.search(headers.get(name, ""))
+            if match:
+                remaining, reset = (int(g) for g in match.groups())
+                limits.append((remaining, max(reset, 1)))
+        if not limits:
+            return
+        self._refill()
+        self.rate = max(min(r / reset for r, reset in limits), settings.MIN_REQUEST_RATE)
+        self.tokens = min(self.tokens, min(r for r, _ in limits))
+
+
+# Runs GETs through a concurrency cap and the rate limiter,
+# retrying 429s, 5xx and connection errors with jittered backoff.
+class Fetcher:
+    def __init__(self, session, concurrency, limiter, max_retries):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = limiter
+        self.max_retries = max_retries
+        # retried along with RETRY_STATUSES
+        import aiohttp
+        self.retry_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after + random.uniform(0, settings.BACKOFF_BASE)
+        # full jitter, capped
+        ceiling = min(settings.BACKOFF_MAX, settings.BACKOFF_BASE * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    async def get_json(self, url):
+        _, _, data = await self.get(url)
+        return data
+
+    async def get(self, url, headers=None):
+        # returns (status, headers, json), where json is None for a 304
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            async with self.semaphore:
+                metrics.count("requests")
+                if attempt:
+                    metrics.count("retries")
+                try:
+                    async with self.session.get(url, headers=headers) as resp:
+                        self.limiter.update_from_headers(resp.headers)
+                        if resp.status == 304:
+                            return resp.status, resp.headers, None
+                        if resp.status < 400:
+                            body = await resp.read()
+                            metrics.count("received_bytes", len(body))
+                            return resp.status, resp.headers, json.loads(body)
+                        if resp.status not in RETRY_STATUSES or attempt >= self.max_retries:
+                            resp.raise_for_status()
+                        retry_after = resp.headers.get("Retry-After")
+                        delay = self.backoff(
+                            attempt,
+                            float(retry_after) if retry_after and retry_after.isdigit() else None,
+                        )
+                except self.retry_errors:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self.backoff(attempt)
+            # sleep outside the semaphore so other checks can use the slot
+            await asyncio.sleep(delay)
+            attempt += 1
 
-async def get_checks(session):
+
+def make_fetcher(session):
+    limiter = RateLimiter(settings.INITIAL_REQUEST_RATE, settings.CONCURRENCY)
+    return Fetcher(session, settings.CONCURRENCY, limiter, settings.MAX_RETRIES)
+
+
+async def get_checks(fetcher, cache, ttl=None):
     url = f"{BASE_URL}/checks?include_tags=true"
-    resp = await session.get(url)
-    resp.raise_for_status()
-    checks = await resp.json()
+    entry = cache.get(url)
+    ttl = settings.CHECKS_CACHE_TTL if ttl is None else ttl
+    if entry is not None and entry.is_fresh(ttl):
+        return entry.value["checks"]
+    headers = entry.conditional_headers() if entry is not None else None
+    status, resp_headers, checks = await fetcher.get(url, headers)
+    if status == 304:
+        return cache.touch(url, entry)["checks"]
+    cache.put(url, checks, resp_headers.get("ETag"), resp_headers.get("Last-Modified"))
     return checks["checks"]
 
 
-async def get_outages(session, check_id):
-    from_ = int(settings.START_DATE.timestamp())
-    to_ = int(settings.END_DATE.timestamp())
-    url = f"{BASE_URL}/summary.outage/{check_id}/?from={from_}&to={to_}"
-    resp = await session.get(url)
-    # print(resp.headers)
-    if resp.status >= 400:
-        # print(await respt.read())
-        resp.raise_for_status()
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def report_window(now):
+    # (from, to) unix times: midnight UTC DAYS_BACK days before now, to now
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    start -= timedelta(days=settings.DAYS_BACK)
+    return int(start.timestamp()), int(now.timestamp())
+
 
-    states = (await resp.json())["summary"]["states"]
+async def get_outages(fetcher, check_id, from_, to_):
+    url = f"{BASE_URL}/summary.outage/{check_id}/?from={from_}&to={to_}"
+    states = (await fetcher.get_json(url))["summary"]["states"]
     return states
 
 
-def upload_report(output_path):
-    s3_name = "%s%s" % (settings.S3_PREFIX, os.path.basename(output_path))
-    s3 = boto3.client("s3")
-    s3.upload_file(output_path, settings.S3_BUCKET, s3_name)
+def report_key(day, filename):
+    if settings.OUTPUT_FORMAT == "parquet":
+        return partition_key(settings.S3_PARQUET_PREFIX, day, filename)
+    return "%s%s" % (settings.S3_PREFIX, filename)
+
+
+def upload_reports(s3, files, stale_keys=()):
+    # s3 is the run's uploader, which backfill chunks share
+    uploaded, skipped = len(s3.uploaded), len(s3.skipped)
+    with metrics.stage("upload"):
+        keys = set()
+        for day, output_path in files:
+            keys.add(report_key(day, os.path.basename(output_path)))
+            s3.submit(output_path, report_key(day, os.path.basename(output_path)))
+        # only once the day files are in
+        s3.wait()
+        # merged days can come out in fewer parquet parts than before
+        for key in set(stale_keys) - keys:
+            s3.delete_object(key)
+    if settings.ROLLUPS:
+        flush_rollups(rollups, s3, metrics)
+    metrics.count("files_uploaded", len(s3.uploaded) - uploaded)
+    metrics.count("files_unchanged", len(s3.skipped) - skipped)
+
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def open_sink(path, mode, compression, buffer_size):
+    # returns the text stream to write to and the underlying file, both of
+    # which must be closed (GzipFile never closes a fileobj it was handed)
+    raw = open(path, mode + "b", buffering=buffer_size)
+    if compression == "gzip":
+        # no timestamp in the header, so an unchanged day compresses to the
+        # same bytes (and ETag) as the copy already uploaded
+        stream = gzip.GzipFile(fileobj=raw, mode=mode + "b", mtime=0)
+    elif compression == "zstd":
+        import zstandard
+
+        stream = zstandard.ZstdCompressor().stream_writer(raw)
+    else:
+        stream = raw
+    return io.TextIOWrapper(stream, encoding="utf-8", newline=""), raw
 
 
 class DatedCSVWriter:
-    def __init__(self, base_path, fieldnames=None):
+    def __init__(
+        self,
+        base_path,
+        fieldnames=None,
+        compression=None,
+        max_open_files=64,
+        buffer_size=1024 * 1024,
+    ):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"unsupported compression: {compression}")
         self.base_path = base_path
         self.fieldnames = fieldnames
-        self._writers = {}
+        self.compression = compression
+        self.max_open_files = max_open_files
+        self.buffer_size = buffer_size
+        # pos -> (writer, text stream, raw file), least recently used first
+        self._writers = collections.OrderedDict()
+        self.paths = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def path_for(self, pos):
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        return f"{self.base_path}/{pos}.csv{suffix}"
 
     def __getitem__(self, pos):
         if pos in self._writers:
-            return self._writers[pos]
+            self._writers.move_to_end(pos)
+            return self._writers[pos][0]
+
+        if len(self._writers) >= self.max_open_files:
+            _, (_, fp, raw) = self._writers.popitem(last=False)
+            fp.close()
+            raw.close()
 
-        output_path = f"{self.base_path}/{pos}.csv"
+        # evicted days are reopened for append, and for compressed output
+        # that appends a new gzip member/zstd frame, which readers (and
+        # Athena) treat as one continuous stream
+        reopening = pos in self.paths
+        output_path = self.paths.setdefault(pos, self.path_for(pos))
         if not os.path.exists(self.base_path):
             os.makedirs(self.base_path, exist_ok=True)
-        fp = open(output_path, "w")
+        fp, raw = open_sink(
+            output_path, "a" if reopening else "w", self.compression, self.buffer_size
+        )
         writer = csv.DictWriter(fp, fieldnames=self.fieldnames)
+        self._writers[pos] = (writer, fp, raw)
+        if not reopening:
+            writer.writeheader()
+        return writer
+
+    def files(self):
+        return sorted(self.paths.items())
+
+    def close(self):
+        while self._writers:
+            _, (_, fp, raw) = self._writers.popitem(last=False)
+            fp.close()
+            raw.close()
+
+
+class ParquetDayWriter:
+    def __init__(self, output_path, columns, row_group_size):
+        self.output_path = output_path
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.rows = []
+        self._writer = None
+
+    def writerow(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        import pyarrow.parquet as pq
+
+        table = rows_to_table(self.rows, self.columns)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(
+                self.output_path, table.schema, compression="snappy"
+            )
+        self._writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+# Same interface as DatedCSVWriter, writing one Parquet file per day.
+# Parquet files can't be appended to, so a day that is evicted and
+# written to again gets a second part file in the same partition.
+class DatedParquetWriter:
+    def __init__(self, base_path, columns, max_open_files=64, row_group_size=100000):
+        self.base_path = base_path
+        self.columns = columns
+        self.max_open_files = max_open_files
+        self.row_group_size = row_group_size
+        self._writers = collections.OrderedDict()
+        # pos -> every part file written for it
+        self.paths = collections.defaultdict(list)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getitem__(self, pos):
+        if pos in self._writers:
+            self._writers.move_to_end(pos)
+            return self._writers[pos]
+
+        if len(self._writers) >= self.max_open_files:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+
+        part = len(self.paths[pos])
+        suffix = f"-{part}" if part else ""
+        output_path = f"{self.base_path}/{pos}{suffix}.parquet"
+        if not os.path.exists(self.base_path):
+            os.makedirs(self.base_path, exist_ok=True)
+        writer = ParquetDayWriter(output_path, self.columns, self.row_group_size)
+        self.paths[pos].append(output_path)
         self._writers[pos] = writer
-        writer.writeheader()
         return writer
 
+    def files(self):
+        return sorted((pos, p) for pos, paths in self.paths.items() for p in paths)
 
-async def write_report(output_path):
-    headers = {"Authorization": f"Bearer {settings.API_KEY}"}
-    fieldnames = ["check_id", "service", "timefrom", "timeto", "status", "tags"]
-    writer = DatedCSVWriter(output_path, fieldnames=fieldnames)
-    async with aiohttp.ClientSession(headers=headers) as session:
-        checks = await get_checks(session)
-        tasks = [asyncio.ensure_future(get_outages(session, c["id"])) for c in checks]
-        pending = tasks[:]
-        active = []
-        while pending:
-            while len(active) > 10:
-                done, _ = await asyncio.wait(
-                    active, return_when=asyncio.FIRST_COMPLETED
+    def close(self):
+        while self._writers:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+
+
+async def as_completed_bounded(jobs, limit):
+    # yield each job's result as it completes, keeping at most limit
+    # tasks (and their results) alive at any one time
+    pending = set()
+    try:
+        for job in jobs:
+            # schedule before waiting, so no job is left unstarted if the
+            # consumer stops early
+            pending.add(asyncio.ensure_future(job))
+            if len(pending) >= limit:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
                 )
                 for d in done:
-                    active.remove(d)
-            active.append(pending.pop())
-        await asyncio.wait(active)
-        for c, t in zip(checks, tasks):
-            states = t.result()
-            for s in states:
-                s["service"] = c["name"]
-                s["check_id"] = c["id"]
-                s["tags"] = ",".join(tag["name"] for tag in c["tags"])
-                day = datetime.fromtimestamp(s["timefrom"], timezone.utc).strftime(
-                    "%Y-%m-%d"
-                )
-                writer[day].writerow(s)
+                    yield d.result()
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for d in done:
+                yield d.result()
+    finally:
+        for p in pending:
+            p.cancel()
+
+
+async def fetch_outages(fetcher, checks, window):
+    # yield (check, states) as each fetch completes
+    async def fetch(check):
+        return check, await get_outages(fetcher, check["id"], *window)
+
+    async for result in as_completed_bounded(
+        (fetch(c) for c in checks), settings.CONCURRENCY
+    ):
+        yield result
+
+
+async def resume_outages(fetcher, checks, window, checkpoint, deadline):
+    # fetch_outages for a resumable run: the states fetched since the last
+    # save go into a checkpoint part as a batch, and the checkpoint itself
+    # only lists the checks done. A run that picks up after a failure or a
+    # chained invocation (which keeps the window the run started with)
+    # replays the parts rather than refetching those checks.
+    window = checkpoint.state.setdefault("window", list(window))
+    done = checkpoint.state.setdefault("checks_done", [])
+    by_id = {str(c["id"]): c for c in checks}
+    for body in checkpoint.parts():
+        for check_id, states in json.loads(body).items():
+            # checks deleted since are left out, as a fresh run would
+            if check_id in by_id:
+                metrics.count("checks_resumed")
+                yield by_id[check_id], states
+    resumed = set(done)
+    remaining = [c for c in checks if str(c["id"]) not in resumed]
+    batch = {}
+
+    def save_batch():
+        if batch:
+            checkpoint.save_part(json.dumps(batch))
+            done.extend(batch)
+            batch.clear()
+
+    last_saved = time.monotonic()
+    results = fetch_outages(fetcher, remaining, window)
+    try:
+        async for check, states in results:
+            # copied before rows are made from them
+            batch[str(check["id"])] = [dict(s) for s in states]
+            yield check, states
+            if time.monotonic() - last_saved >= settings.CHECKPOINT_INTERVAL:
+                save_batch()
+                checkpoint.save()
+                last_saved = time.monotonic()
+            deadline.check()
+    except BaseException:
+        # resumable() saves the checkpoint on the way out
+        save_batch()
+        raise
+    finally:
+        await results.aclose()
+
+
+def outage_windows(start, end, days):
+    # [from, to) unix time pairs of at most days each, covering start to end
+    step = days * 86400
+    while start < end:
+        yield start, min(start + step, end)
+        start += step
+
+
+def stitch_states(states):
+    # pieces of one state fetched from neighbouring windows overlap or touch
+    merged = []
+    for s in sorted(states, key=lambda s: (s["timefrom"], s["timeto"])):
+        last = merged[-1] if merged else None
+        if last and last["status"] == s["status"] and s["timefrom"] <= last["timeto"]:
+            last["timeto"] = max(last["timeto"], s["timeto"])
+        else:
+            merged.append(s)
+    return merged
+
+
+async def fetch_outage_windows(fetcher, checks, windows, carried=None):
+    # Like fetch_outages, with one request per check per window. A state
+    # crossing a window boundary comes back from both windows (whole, or
+    # clipped to each), so each check's boundary states are held back and
+    # stitched once all of its windows are in. carried maps check ids to
+    # their last state from the backfill chunk before, which crosses into
+    # these windows the same way: it's stitched with them, and only comes
+    # back if that changed it. It's then updated with each check's last
+    # state here, for the next chunk.
+    windows = list(windows)
+    last_to = windows[-1][1]
+    remaining = {c["id"]: len(windows) for c in checks}
+    held = collections.defaultdict(list)
+
+    async def fetch(check, window):
+        return check, window, await get_outages(fetcher, check["id"], *window)
+
+    jobs = (fetch(c, w) for c in checks for w in windows)
+    async for check, (from_, to_), states in as_completed_bounded(
+        jobs, settings.CONCURRENCY
+    ):
+        inner = []
+        for s in states:
+            if s["timefrom"] <= from_ or s["timeto"] >= to_:
+                held[check["id"]].append(s)
+            else:
+                inner.append(s)
+        remaining[check["id"]] -= 1
+        if not remaining[check["id"]]:
+            inner.extend(stitch_carried(held.pop(check["id"], []), carried, str(check["id"]), last_to))
+        if inner:
+            yield check, inner
+
+
+def stitch_carried(states, carried, check_id, last_to):
+    # stitch_states for one check's boundary states, with its carried state
+    if carried is None:
+        return stitch_states(states)
+    previous, timeto = carried.pop(check_id, None), None
+    if previous is not None:
+        previous = dict(previous)
+        timeto = previous["timeto"]
+        states = [previous] + states
+    stitched = stitch_states(states)
+    if stitched and stitched[-1]["timeto"] >= last_to:
+        # copied before rows are made from it
+        carried[check_id] = dict(stitched[-1])
+    return [s for s in stitched if s is not previous or s["timeto"] != timeto]
+
+
+def load_cursor(s3):
+    # check id -> {"timeto": end of the last fetch, "lasterrortime": as of
+    # then, "last": the check's latest state, which may still be going on}
+    body = s3.read_object(settings.CURSOR_KEY)
+    return json.loads(body) if body else {}
+
+
+def save_cursor(s3, cursor):
+    s3.write_object(settings.CURSOR_KEY, json.dumps(cursor))
+
+
+def check_unchanged(check, position):
+    # no error since the last run, which saw it up, so it's still up and
+    # there's nothing new to record beyond a longer up state
+    return (
+        position is not None
+        and position["last"] is not None
+        and position["last"]["status"] == "up"
+        and check.get("lasterrortime") == position["lasterrortime"]
+    )
+
+
+async def fetch_since_cursor(fetcher, checks, cursor, window):
+    # fetch_outages for an incremental run: each check is only asked for
+    # states since its cursor, and checks that are paused or haven't failed
+    # since are skipped. A check's latest state from the last run comes back
+    # again, extended, and is stitched with the saved one so it's rewritten
+    # in place. cursor is updated as checks come in; it's only saved once
+    # the day files are uploaded. Checks without a cursor start at the start
+    # of window.
+    start, to_ = window
+    live = {str(c["id"]) for c in checks}
+    for check_id in list(cursor):
+        if check_id not in live:
+            del cursor[check_id]
+    wanted = []
+    for c in checks:
+        if c.get("status") == "paused":
+            metrics.count("checks_paused")
+        elif check_unchanged(c, cursor.get(str(c["id"]))):
+            metrics.count("checks_unchanged")
+        else:
+            wanted.append(c)
+
+    async def fetch(check):
+        position = cursor.get(str(check["id"]))
+        from_ = position["timeto"] if position else start
+        states = await get_outages(fetcher, check["id"], from_, to_)
+        if position and position["last"]:
+            states = stitch_states([dict(position["last"])] + states)
+        cursor[str(check["id"])] = {
+            "timeto": to_,
+            "lasterrortime": check.get("lasterrortime"),
+            "last": dict(states[-1]) if states else None,
+        }
+        return check, states
+
+    async for result in as_completed_bounded(
+        (fetch(c) for c in wanted), settings.CONCURRENCY
+    ):
+        yield result
+
+
+CSV_TYPES = {name: int if athena_type == "bigint" else str for name, athena_type in REPORT_COLUMNS}
+
+
+def read_uploaded_day(s3, day):
+    # the rows already in S3 for day, and the keys they came from
+    if settings.OUTPUT_FORMAT == "parquet":
+        import pyarrow.parquet as pq
+
+        rows, keys = [], []
+        while True:
+            suffix = f"-{len(keys)}" if keys else ""
+            key = report_key(day, f"{day}{suffix}.parquet")
+            body = s3.read_object(key)
+            if body is None:
+                return rows, keys
+            rows.extend(pq.read_table(io.BytesIO(body)).to_pylist())
+            keys.append(key)
+    key = report_key(day, f"{day}.csv{COMPRESSION_SUFFIXES[settings.OUTPUT_COMPRESSION]}")
+    body = s3.read_object(key)
+    if body is None:
+        return [], []
+    if settings.OUTPUT_COMPRESSION == "gzip":
+        body = gzip.decompress(body)
+    elif settings.OUTPUT_COMPRESSION == "zstd":
+        import zstandard
+
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(body), read_across_frames=True
+        )
+        body = reader.read()
+    reader = csv.DictReader(io.StringIO(body.decode("utf-8")))
+    return [{k: CSV_TYPES[k](v) for k, v in row.items()} for row in reader], [key]
+
+
+async def merge_with_uploaded(rows, stale_keys, s3, before=None):
+    # Incremental runs only fetch new states, so each day they touch is
+    # merged with what's already in S3 (with before, only the days earlier
+    # than that, which a backfill doesn't cover): a new row replaces the
+    # uploaded one for the same check and start time (a state that has grown
+    # since), and is added otherwise. New rows pass straight through, and only
+    # their keys are kept; once they're all in, the uploaded rows they didn't
+    # replace follow, one day at a time (the next day is read while one is
+    # written), so the merged days are written out whole. Keys of the uploaded
+    # parquet parts go in stale_keys, for those the merged day no longer needs.
+    new_keys = collections.defaultdict(set)
+    async for day, row in rows:
+        if before is None or day < before:
+            new_keys[day].add((row["check_id"], row["timefrom"]))
+        yield day, row
+    # S3 reads block, so they're run off the event loop
+    loop = asyncio.get_event_loop()
+    days = sorted(new_keys)
+    reading = None
+    for n, day in enumerate(days):
+        if reading is None:
+            reading = loop.run_in_executor(None, read_uploaded_day, s3, day)
+        with metrics.stage("read_uploaded"):
+            uploaded, keys = await reading
+        reading = None
+        if n + 1 < len(days):
+            reading = loop.run_in_executor(None, read_uploaded_day, s3, days[n + 1])
+        stale_keys.extend(keys)
+        metrics.count("rows_merged", len(uploaded))
+        replaced = new_keys.pop(day)
+        for row in uploaded:
+            if (row["check_id"], row["timefrom"]) not in replaced:
+                yield day, row
+
+
+async def outage_rows(results):
+    async for c, states in results:
+        tags = ",".join(tag["name"] for tag in c["tags"])
+        for s in states:
+            s["service"] = c["name"]
+            s["check_id"] = c["id"]
+            s["tags"] = tags
+            day = datetime.fromtimestamp(s["timefrom"], timezone.utc).strftime(
+                "%Y-%m-%d"
+            )
+            yield day, s
+
+
+async def write_report(
+    output_path,
+    s3,
+    cache,
+    windows=None,
+    checkpoint=None,
+    deadline=None,
+    cursor=None,
+    stale_keys=None,
+    window=None,
+    merge_before=None,
+    carried=None,
+):
+    headers = {"Authorization": f"Bearer {settings.API_KEY}"}
+    if settings.OUTPUT_FORMAT == "parquet":
+        writer = DatedParquetWriter(
+            output_path, REPORT_COLUMNS, max_open_files=settings.MAX_OPEN_FILES
+        )
+    else:
+        writer = DatedCSVWriter(
+            output_path,
+            fieldnames=[name for name, _ in REPORT_COLUMNS],
+            compression=settings.OUTPUT_COMPRESSION,
+            max_open_files=settings.MAX_OPEN_FILES,
+            buffer_size=settings.WRITE_BUFFER_SIZE,
+        )
+    # aiohttp is only imported once there's something to fetch
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=settings.CONCURRENCY)
+    with writer:
+        async with aiohttp.ClientSession(
+            headers=headers, connector=connector
+        ) as session:
+            fetcher = make_fetcher(session)
+            with metrics.stage("get_checks"):
+                # incremental runs need every check's current lasterrortime
+                ttl = 0 if cursor is not None else None
+                checks = await get_checks(fetcher, cache, ttl)
+            metrics.count("checks", len(checks))
+            # checks -> outage fetch -> row enrichment -> day-sharded writer;
+            # fetching and writing overlap, so only the total is timed
+            if cursor is not None:
+                results = fetch_since_cursor(fetcher, checks, cursor, window)
+            elif windows is None and checkpoint is not None:
+                results = resume_outages(fetcher, checks, window, checkpoint, deadline)
+            elif windows is None:
+                results = fetch_outages(fetcher, checks, window)
+            else:
+                results = fetch_outage_windows(fetcher, checks, windows, carried)
+            rows = 0
+            partials = collections.defaultdict(rollups.new_partials)
+            day_rows = outage_rows(results)
+            if cursor is not None:
+                day_rows = merge_with_uploaded(day_rows, stale_keys, s3)
+            elif merge_before is not None:
+                day_rows = merge_with_uploaded(day_rows, stale_keys, s3, merge_before)
+            with metrics.stage("fetch_and_write"):
+                async for day, row in day_rows:
+                    writer[day].writerow(row)
+                    rollups.add(partials[day], row)
+                    rows += 1
+            metrics.count("rows", rows)
+            # flushed by upload_reports along with the day files
+            rollups.set_days(partials)
+    # every file is flushed and closed by now
+    return writer.files()
+
+
+def backfill_timestamp(day):
+    day = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(day.timestamp())
+
+
+async def backfill(start, end, checkpoint, deadline, s3, cache):
+    # Reload START (inclusive) to END (exclusive), both YYYY-MM-DD, one chunk
+    # of BACKFILL_CHUNK_DAYS at a time. Each chunk's day files are uploaded
+    # and checkpointed before the next starts, so a backfill that fails or
+    # runs out of time picks up at the first unfinished chunk.
+    done_until = checkpoint.state.get("done_until")
+    # each check's last state of the chunk before, to stitch with this one's
+    carried = checkpoint.state.get("carried", {})
+    for chunk_from, chunk_to in outage_windows(
+        backfill_timestamp(start), backfill_timestamp(end), settings.BACKFILL_CHUNK_DAYS
+    ):
+        if done_until is not None and chunk_to <= done_until:
+            continue
+        deadline.check()
+        windows = outage_windows(chunk_from, chunk_to, settings.OUTAGE_WINDOW_DAYS)
+        # a state going on when the chunk starts is dated the day it started,
+        # before the chunk, so that day is merged with its upload rather than
+        # replaced by the one row
+        stale_keys = []
+        files = await write_report(
+            settings.OUTPUT_PATH,
+            s3,
+            cache,
+            windows,
+            stale_keys=stale_keys,
+            merge_before=datetime.fromtimestamp(chunk_from, timezone.utc).strftime("%Y-%m-%d"),
+            carried=carried,
+        )
+        upload_reports(s3, files, stale_keys)
+        for _, path in files:
+            os.remove(path)
+        checkpoint.state["done_until"] = chunk_to
+        checkpoint.state["carried"] = carried
+        checkpoint.save()
+        metrics.count("backfill_chunks")
 
 
-async def main():
-    await write_report(settings.OUTPUT_PATH)
-    for f in glob.glob(f"{settings.OUTPUT_PATH}/*.csv"):
-        upload_report(f)
+async def main(event=None, context=None):
+    # event may hold {"backfill": {"start": ..., "end": ...}} and/or
+    # {"profile": path}; context is the lambda context, None when run locally
+    event = event or {}
+    window = report_window(utcnow())
+    backfill_range = None
+    if "backfill" in event:
+        backfill_range = (event["backfill"]["start"], event["backfill"]["end"])
+        job = {"backfill": list(backfill_range)}
+    elif settings.INCREMENTAL:
+        # the cursor is the progress: a failed run just starts from it again
+        job = {"incremental": True}
+    else:
+        job = {"from": window[0]}
+    # one uploader (and S3 client) for everything the run reads and writes
+    with S3Uploader(settings.S3_BUCKET, max_workers=settings.UPLOAD_WORKERS) as s3:
+        checkpoint = open_report_checkpoint(settings, job, s3)
+        cache = open_report_cache(settings, s3)
+        deadline = Deadline(context, settings.CHAIN_MARGIN_SECONDS)
+        try:
+            profile_path = event.get("profile") or settings.PROFILE_PATH
+            with profiled(profile_path), metrics.stage("total"):
+                with resumable(checkpoint, event, context, settings.MAX_CHAINED_RUNS):
+                    if backfill_range:
+                        await backfill(*backfill_range, checkpoint, deadline, s3, cache)
+                    elif settings.INCREMENTAL:
+                        cursor = load_cursor(s3)
+                        stale_keys = []
+                        files = await write_report(
+                            settings.OUTPUT_PATH,
+                            s3,
+                            cache,
+                            cursor=cursor,
+                            stale_keys=stale_keys,
+                            window=window,
+                        )
+                        upload_reports(s3, files, stale_keys)
+                        save_cursor(s3, cursor)
+                    else:
+                        files = await write_report(
+                            settings.OUTPUT_PATH,
+                            s3,
+                            cache,
+                            checkpoint=checkpoint,
+                            deadline=deadline,
+                            window=window,
+                        )
+                        upload_reports(s3, files)
+        finally:
+            cache.close()
+            metrics.flush(
+                settings.METRICS_OUTPUT,
+                settings.METRICS_NAMESPACE,
+                {"Report": "pingdom"},
+            )
 
 
 def lambda_handler(event, context):
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    loop.run_until_complete(main(event, context))
 
 
 if __name__ == "__main__":
+    # pingdom_report.py [START END] to backfill days START (inclusive) to END (exclusive)
+    event = None
+    if len(sys.argv) == 3:
+        event = {"backfill": {"start": sys.argv[1], "end": sys.argv[2]}}
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    loop.run_until_complete(main(event))
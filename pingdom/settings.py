@@ -1,14 +1,84 @@
 import os
-from datetime import datetime, timedelta, timezone
 
 # credential for pingdom v3 api
 API_KEY = os.environ['API_KEY']
 # s3 url to upload report into
 S3_BUCKET = os.environ['S3_BUCKET']
 S3_PREFIX = 'pingdom_outages/'
+# maintain weekly and monthly downtime rollups per check (pingdom_outages_weekly/,
+# pingdom_outages_monthly/) of the days written; the partial sums they're built
+# from are kept under ROLLUP_STATE_PREFIX in S3_BUCKET
+ROLLUPS = True
+ROLLUP_STATE_PREFIX = 'manifests/rollups/'
+# number of files uploaded to s3 concurrently
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 8))
 
-# Fetch everything from yesterday to now
-START_DATE = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0) - timedelta(days=1)
-END_DATE = datetime.now(timezone.utc)
+# Incremental runs (the default) keep a cursor per check at CURSOR_KEY in
+# S3_BUCKET, and only fetch states since it for checks that aren't paused and
+# have failed since (or were down) last run; the day files those touch are
+# merged with the uploaded ones. Checks without a cursor start DAYS_BACK days ago.
+# Otherwise every check is fetched and its day files rewritten from then.
+INCREMENTAL = True
+CURSOR_KEY = 'manifests/pingdom_cursor.json'
+
+# Fetch everything from midnight UTC this many days ago to the time of each run
+DAYS_BACK = 1
 
 OUTPUT_PATH = "/tmp/pingdom_report/"
+# 'csv', or 'parquet' (needs pyarrow) to write date partitions under S3_PARQUET_PREFIX
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'csv')
+S3_PARQUET_PREFIX = 'pingdom_outages_parquet/'
+# csv only: None, 'gzip' or 'zstd' (zstd needs the zstandard package); athena reads all three
+OUTPUT_COMPRESSION = os.environ.get('OUTPUT_COMPRESSION') or None
+# day files kept open at once; older ones are closed and reopened for append
+MAX_OPEN_FILES = 64
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# max number of concurrent requests to the pingdom api
+CONCURRENCY = int(os.environ.get('CONCURRENCY', 10))
+# requests/second to start at, until Req-Limit-* headers tell us the real budget
+INITIAL_REQUEST_RATE = float(os.environ.get('INITIAL_REQUEST_RATE', 5))
+# never throttle below this, even when the api says we are nearly out
+MIN_REQUEST_RATE = 0.1
+# retries for 429/5xx/connection errors, with jittered exponential backoff (seconds)
+MAX_RETRIES = int(os.environ.get('MAX_RETRIES', 6))
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+# cache for the check list between runs: off by default (''), 's3' (objects
+# under CACHE_PREFIX in S3_BUCKET) or 'sqlite' (at CACHE_PATH, so only across
+# warm starts); worth turning on for backfills
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or None
+CACHE_PATH = '/tmp/pingdom_cache.sqlite'
+CACHE_PREFIX = 'cache/pingdom/'
+# seconds a cached check list is used before revalidating it with the api
+CHECKS_CACHE_TTL = 3600
+
+# checks fetched and skipped, rows, files uploaded and time per stage, as
+# 'emf' lines on stdout for CloudWatch, appended to a path, or '' for none
+METRICS_OUTPUT = os.environ.get('METRICS_OUTPUT', 'emf')
+METRICS_NAMESPACE = 'MonitoringReports'
+# cProfile dump (and top allocations) of every run; an event can ask for one
+# run's with {"profile": path}, e.g. to see what fetch_and_write is waiting on
+PROFILE_PATH = os.environ.get('PROFILE_PATH') or None
+
+# backfills (pingdom_report.py START END) run in chunks of BACKFILL_CHUNK_DAYS,
+# each uploaded and checkpointed before the next, and fetch every check's
+# share of a chunk as parallel OUTAGE_WINDOW_DAYS windows
+BACKFILL_CHUNK_DAYS = 28
+OUTAGE_WINDOW_DAYS = 7
+
+# a full (not INCREMENTAL) run saves the checks it has fetched, in batches
+# next to its checkpoint, and a backfill the chunks it has uploaded, so either
+# picks up where it stopped. The checkpoint is off by default (''), a file at
+# CHECKPOINT_PATH ('file') or an object at CHECKPOINT_KEY in S3_BUCKET ('s3',
+# which needs the extra S3 permissions listed in the README); on lambda, a run
+# down to CHAIN_MARGIN_SECONDS re-invokes itself, up to MAX_CHAINED_RUNS times
+# in a row (see common/checkpoint.py)
+CHECKPOINT_BACKEND = os.environ.get('CHECKPOINT_BACKEND') or None
+CHECKPOINT_KEY = 'manifests/pingdom_checkpoint.json'
+CHECKPOINT_PATH = '/tmp/pingdom_checkpoint.json'
+# seconds between checkpoint saves while a run is going
+CHECKPOINT_INTERVAL = 60
+CHAIN_MARGIN_SECONDS = 120
+MAX_CHAINED_RUNS = 20
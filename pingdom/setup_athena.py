@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+from athena import database_query, parquet_table_query, rollup_table_queries, run_queries
+import sys
+
+bucket = sys.argv[1]
+prefix = 'pingdom_outages'
+
+columns = [
+    ('check_id', 'bigint'),
+    ('service', 'string'),
+    ('timefrom', 'bigint'),
+    ('timeto', 'bigint'),
+    ('status', 'string'),
+    ('tags', 'string'),
+]
+
+rollup_columns = {
+    'pingdom_outages': [
+        ('period_start', 'date'),
+        ('check_id', 'bigint'),
+        ('service', 'string'),
+        ('outages', 'int'),
+        ('down_seconds', 'bigint'),
+    ],
+}
+rollup_queries = [query for name, rollup in rollup_columns.items()
+                  for query in rollup_table_queries(bucket, name, rollup)]
+
+print('Creating athena table monitoring_reports.%s_parquet at s3://%s/%s_parquet with' %
+      (prefix, bucket, prefix))
+run_queries(bucket, [database_query(),
+                     parquet_table_query(bucket, prefix, columns)] + rollup_queries)
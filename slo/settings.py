@@ -1,16 +1,74 @@
 import os
-from datetime import date, timedelta
 
-# DRY_RUN to skip uploading to S3
+# DRY_RUN reads the manifest and the rest of the run's state from S3 as usual,
+# but only prints the day files, manifest, rollups, cache entries and
+# checkpoint it would write there; with the manifest left as it was, the next
+# real run regenerates the same days
 DRY_RUN = False
 # credential for statuspage v1 api
 API_KEY = os.environ['API_KEY']
+# number of api pages fetched ahead of the one being processed
+PREFETCH_PAGES = 4
 # id of our status page
 PAGE_ID = '76k9j8n4y3zt'
 # s3 url to upload report into
 S3_BUCKET = os.environ['S3_BUCKET']
-# regen previous week on every run
-# to account for people filling in postmortems
-# end is exclusive so skips current day
-START_DATE = date.today() - timedelta(days=1095)
-END_DATE = date.today()
+# 'json', or 'parquet' (needs pyarrow) to write date partitions
+# under slo_parquet/ and statuspage_incidents_parquet/
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'json')
+# maintain weekly and monthly uptime rollups (slo_weekly/, slo_monthly/) of the
+# days regenerated; the partial sums they're built from are kept under
+# ROLLUP_STATE_PREFIX in S3_BUCKET. Run once with {"full_rebuild": true} to
+# fill in the days from before they were turned on.
+ROLLUPS = True
+ROLLUP_STATE_PREFIX = 'manifests/rollups/'
+# number of files uploaded to s3 concurrently
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 8))
+# days reported on, up to but not including today (as of each run). With
+# INCREMENTAL, only the days the manifest shows have changed (or has no record
+# of) are regenerated; a full_rebuild, or INCREMENTAL = False, regenerates them
+# all
+DAYS = 1095
+# only regenerate days touched by new or edited incidents since the last run,
+# tracked in a manifest object in S3_BUCKET (outside the athena prefixes)
+INCREMENTAL = True
+MANIFEST_KEY = 'manifests/slo_manifest.json'
+# incidents resolved longer ago than this can't get postmortem edits any more,
+# so they are cached for good and paging stops once it reaches them
+EDIT_WINDOW_DAYS = 7
+# cache for components and settled incidents between runs: off by default
+# (''), 's3' (objects under CACHE_PREFIX in S3_BUCKET) or 'sqlite' (at
+# CACHE_PATH, so only across warm starts)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or None
+CACHE_PATH = '/tmp/slo_cache.sqlite'
+CACHE_PREFIX = 'cache/slo/'
+# seconds a cached components page is used before revalidating it with the api
+COMPONENTS_CACHE_TTL = 3600
+# incident descriptions (every update and the postmortem) are kept here rather
+# than in memory, and read back as their days are written
+DESCRIPTIONS_PATH = '/tmp/slo_descriptions'
+# the raw components and incidents from the api are dumped to files starting
+# with this, for looking into a run; on lambda only /tmp is writable
+DUMP_PREFIX = '/tmp/slo_raw_'
+
+# api requests, days processed and skipped, rows and time per stage, as
+# 'emf' lines on stdout for CloudWatch, appended to a path, or '' for none
+METRICS_OUTPUT = os.environ.get('METRICS_OUTPUT', 'emf')
+METRICS_NAMESPACE = 'MonitoringReports'
+# cProfile dump (and top allocations) of every run; an event can ask for one
+# run's with {"profile": path}, e.g. for a full_rebuild
+PROFILE_PATH = os.environ.get('PROFILE_PATH') or None
+
+# the components and incidents a run started with, and the days it has
+# uploaded, are kept in a checkpoint so a failed or chained run carries on
+# with the same data. It's off by default (''), a file at CHECKPOINT_PATH
+# ('file') or an object at CHECKPOINT_KEY in S3_BUCKET ('s3', which needs the
+# extra S3 permissions listed in the README); on lambda, a run down to
+# CHAIN_MARGIN_SECONDS re-invokes itself, up to MAX_CHAINED_RUNS times in a row
+CHECKPOINT_BACKEND = os.environ.get('CHECKPOINT_BACKEND') or None
+CHECKPOINT_KEY = 'manifests/slo_checkpoint.json'
+CHECKPOINT_PATH = '/tmp/slo_checkpoint.json'
+# seconds between checkpoint saves while a run is going
+CHECKPOINT_INTERVAL = 60
+CHAIN_MARGIN_SECONDS = 120
+MAX_CHAINED_RUNS = 20
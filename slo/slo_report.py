@@ -1,76 +1,289 @@
 #!/usr/bin/env python3
 
-from datetime import datetime, timedelta
-from pytz import timezone
-import boto3
+from checkpoint import Deadline, OutOfTime, open_report_checkpoint, resumable
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache, partial
+from jsonl import JSONLinesWriter
+from metrics import Metrics, profiled
+from parquet_output import partition_key, write_parquet
+from records import Interner, TextStore
+from response_cache import open_report_cache
+from rollups import Rollup, Rollups, flush_rollups
+from timestamps import epoch_ms, from_epoch_ms, parse_timestamp
+from uploader import S3Uploader
+import hashlib
 import json
-import requests
 import settings
 import collections
-
-
-def timerange_for_report():
-    start_date = settings.START_DATE
-    end_date = settings.END_DATE
+import time
+
+BASE_URL = "http://api.statuspage.io/v1"
+SETTLED_INCIDENTS_KEY = 'statuspage:settled_incident_records:3'
+DESCRIPTION_KEY = 'statuspage:incident_description:%s'
+
+metrics = Metrics()
+intern = Interner()
+
+# weekly and monthly uptime per component, for the dashboards
+rollups = Rollups([
+    Rollup('slo', ['component'], [
+        ('days', 'count', None),
+        ('uptime', 'mean', 'uptime'),
+        ('num_outages', 'sum', 'num_outages'),
+    ]),
+], settings.ROLLUP_STATE_PREFIX)
+
+# column types, matching the tables the setup_athena_*.py scripts create
+SLO_COLUMNS = [
+    ('date', 'timestamp'),
+    ('component', 'string'),
+    ('uptime', 'float'),
+    ('num_outages', 'int'),
+]
+INCIDENT_COLUMNS = [
+    ('name', 'string'),
+    ('id', 'string'),
+    ('created_at', 'timestamp'),
+    ('resolved_at', 'timestamp'),
+    ('duration', 'int'),
+    ('component_name', 'string'),
+    ('component_id', 'string'),
+    ('group_name', 'string'),
+    ('group_id', 'string'),
+    ('impact', 'string'),
+    ('description', 'string'),
+]
+
+
+class Incident:
+    # The parts of a Statuspage incident the reports use, so the raw JSON
+    # (every update, for years of incidents) isn't held for the whole run.
+    # Times are epoch milliseconds, components are shared (name, id,
+    # group_id) tuples, and descriptions are kept in a TextStore by id.
+    __slots__ = ('id', 'name', 'impact', 'created_at', 'resolved_at',
+                 'updated_at', 'components', 'false_positive')
+
+    def __init__(self, id, name, impact, created_at, resolved_at, updated_at,
+                 components, false_positive):
+        self.id = id
+        self.name = name
+        self.impact = impact
+        self.created_at = created_at
+        self.resolved_at = resolved_at
+        self.updated_at = updated_at
+        self.components = components
+        self.false_positive = false_positive
+
+    @classmethod
+    def from_api(cls, i):
+        resolved_at = i['resolved_at']
+        postmortem = i['postmortem_body']
+        return cls(i['id'], i['name'], intern(i['impact']),
+                   epoch_ms(i['created_at']),
+                   epoch_ms(resolved_at) if resolved_at is not None else None,
+                   epoch_ms(i['updated_at']),
+                   tuple(intern((intern(c['name']), c['id'], c['group_id']))
+                         for c in i['components']),
+                   bool(postmortem) and 'false positive' in postmortem.lower())
+
+    # checkpoints and the settled incidents cache hold them as lists
+    def to_state(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_state(cls, state):
+        incident = cls(*state)
+        incident.impact = intern(incident.impact)
+        incident.components = tuple(
+            intern((intern(name), component_id, group_id))
+            for name, component_id, group_id in incident.components)
+        return incident
+
+
+def incident_description(i):
+    # all updates sorted oldest to newest, then the postmortem
+    updates = "\t".join([u["body"] for u in i["incident_updates"][::-1]])
+    return updates + f'\t{i["postmortem_body"]}'
+
+
+def report_dates():
+    end_date = date.today()
+    return end_date - timedelta(days=settings.DAYS), end_date
+
+
+def timerange_for_report(start_date, end_date):
     for n in range(int((end_date - start_date).days)):
         yield start_date + timedelta(n)
 
 
-def statuspage_request(path, offset=1):
-    url = "http://api.statuspage.io/v1/pages/%s/%s/?page=%s" % (
+@lru_cache(maxsize=1)
+def get_session():
+    # one pooled session, with room for every prefetched page; requests is
+    # only imported once there's something to fetch
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=settings.PREFETCH_PAGES)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Authorization"] = "OAuth %s" % settings.API_KEY
+    session.hooks['response'].append(count_response)
+    return session
+
+
+def count_response(r, *args, **kwargs):
+    metrics.count('requests')
+    metrics.count('received_bytes', len(r.content))
+
+
+def statuspage_url(path, offset):
+    return "%s/pages/%s/%s/?page=%s" % (
+        BASE_URL,
         settings.PAGE_ID,
         path,
         offset,
     )
-    headers = {"Authorization": "OAuth %s" % settings.API_KEY}
-    r = requests.get(url, headers=headers)
-    r.raise_for_status()
-    return r.json()
 
 
-def get_components():
-    components = []
-    offset = 1
-    r = statuspage_request('components.json', offset)
-    components = components + r
-    while len(r) == 100:
-        offset += 1
-        r = statuspage_request("components.json", offset)
-        components = components + r
-    return components
+def statuspage_request(path, offset=1):
+    r = get_session().get(statuspage_url(path, offset))
+    r.raise_for_status()
+    return r.json()
 
 
-def check_if_need_more_incidents(incidents):
+def cached_statuspage_request(cache, path, offset=1):
+    # served from the cache for COMPONENTS_CACHE_TTL, then revalidated
+    url = statuspage_url(path, offset)
+    entry = cache.get(url)
+    if entry is not None and entry.is_fresh(settings.COMPONENTS_CACHE_TTL):
+        return entry.value
+    headers = entry.conditional_headers() if entry is not None else {}
+    r = get_session().get(url, headers=headers)
+    if r.status_code == 304:
+        return cache.touch(url, entry)
+    r.raise_for_status()
+    return cache.put(url, r.json(), r.headers.get('ETag'),
+                     r.headers.get('Last-Modified'))
+
+
+def paginate(path, need_more, request=statuspage_request, prefetch=None):
+    # yield items page by page, in order, while speculatively fetching the
+    # next PREFETCH_PAGES pages; pages past the end just come back empty
+    prefetch = prefetch or settings.PREFETCH_PAGES
+    with ThreadPoolExecutor(max_workers=prefetch) as pool:
+        pending = collections.deque()
+        next_offset = 1
+        for _ in range(prefetch):
+            pending.append(pool.submit(request, path, next_offset))
+            next_offset += 1
+        while pending:
+            page = pending.popleft().result()
+            yield from page
+            if not need_more(page):
+                break
+            pending.append(pool.submit(request, path, next_offset))
+            next_offset += 1
+        for f in pending:
+            f.cancel()
+
+
+def get_components(cache):
+    return list(paginate('components.json', lambda page: len(page) == 100,
+                         request=partial(cached_statuspage_request, cache)))
+
+
+def check_if_need_more_incidents(incidents, start_date):
     if len(incidents) != 100:
         return False
 
     earliest_resolved = read_statuspage_timestamp(
         incidents[-1]['resolved_at']).date()
-    if earliest_resolved < settings.START_DATE:
+    if earliest_resolved < start_date:
         return False
 
     return True
 
 
-def get_incidents():
-    incidents = []
-    offset = 1
-    r = statuspage_request("incidents.json", offset)
-    incidents = incidents + r
-    while check_if_need_more_incidents(r):
-        offset += 1
-        r = statuspage_request("incidents.json", offset)
-        incidents = incidents + r
-    return incidents
+def incident_is_settled(i, cutoff_day):
+    return (i.resolved_at is not None and
+            from_epoch_ms(i.resolved_at).date() < cutoff_day)
 
 
-def incident_is_ongoing(i):
-    return i['status'] != 'resolved'
+def load_settled_incidents(cache, start_date):
+    entry = cache.get(SETTLED_INCIDENTS_KEY)
+    if entry is None or entry.value['start_date'] > start_date.isoformat():
+        return None
+    return entry.value
+
+
+def save_settled_incidents(cache, incidents, previous, descriptions,
+                           start_date, end_date):
+    # everything created before the oldest incident that could still change
+    cutoff_day = end_date - timedelta(days=settings.EDIT_WINDOW_DAYS)
+    unsettled = [i.created_at for i in incidents
+                 if not incident_is_settled(i, cutoff_day)]
+    if unsettled:
+        before = min(unsettled)
+    elif incidents:
+        before = incidents[0].created_at
+    else:
+        return
+    if previous and (previous['before'], previous['start_date']) == (
+            before, start_date.isoformat()):
+        return
+    # incidents resolved before start_date don't touch any reported day
+    settled = [i for i in incidents if i.created_at < before and
+               from_epoch_ms(i.resolved_at).date() >= start_date]
+    # each description gets its own entry once, when its incident settles,
+    # so the settled entry itself stays small
+    known = {state[0] for state in previous['incidents']} if previous else ()
+    for i in settled:
+        if i.id not in known and i.id in descriptions:
+            cache.put(DESCRIPTION_KEY % i.id, descriptions.get(i.id))
+    cache.put(SETTLED_INCIDENTS_KEY, {
+        'before': before, 'start_date': start_date.isoformat(),
+        'incidents': [i.to_state() for i in settled]})
+
+
+def get_incidents(cache, descriptions, start_date, end_date):
+    # settled incidents come from the cache, so only pages newer than the
+    # oldest incident still open to edits are fetched. Each incident is
+    # reduced to a record as its page arrives; the descriptions of those
+    # that get reported go to the descriptions store.
+    settled = load_settled_incidents(cache, start_date)
+
+    def need_more(incidents):
+        if (settled and incidents and
+                epoch_ms(incidents[-1]['created_at']) < settled['before']):
+            return False
+        return check_if_need_more_incidents(incidents, start_date)
+
+    # with settled history cached there's usually only a page or two to fetch
+    incidents = []
+    with JSONLinesWriter(settings.DUMP_PREFIX + "incidents.jsonl") as output:
+        for i in paginate('incidents.json', need_more,
+                          prefetch=1 if settled else None):
+            output.write(i)
+            incident = Incident.from_api(i)
+            if incident_is_reported(incident, start_date, end_date):
+                descriptions.put(incident.id, incident_description(i))
+            incidents.append(incident)
+    if settled:
+        seen = {i.id for i in incidents}
+        for state in settled['incidents']:
+            incident = Incident.from_state(state)
+            if incident.id not in seen:
+                incidents.append(incident)
+        incidents.sort(key=lambda i: i.created_at, reverse=True)
+    save_settled_incidents(cache, incidents, settled, descriptions,
+                           start_date, end_date)
+    return incidents
 
 
 def read_statuspage_timestamp(timestamp):
-    dt = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
-    return timezone('UTC').localize(dt)
+    return parse_timestamp(timestamp)
 
 
 # JSON SerDE wants timestamp to be yyyy-mm-dd hh:mm:ss[.fffffffff]
@@ -79,8 +292,8 @@ def timestamp_for_hive(dt):
 
 
 def calculate_incident_duration(i):
-    created = read_statuspage_timestamp(i['created_at'])
-    resolved = read_statuspage_timestamp(i['resolved_at'])
+    created = from_epoch_ms(i.created_at)
+    resolved = from_epoch_ms(i.resolved_at)
     delta = resolved - created
     return int(delta.total_seconds())
 
@@ -93,137 +306,397 @@ def find_groups(components):
     return groups_by_id
 
 
-def group_incidents_by_day(incidents):
+def incident_is_reportable(i):
+    # skip ongoing incidents
+    if i.resolved_at is None:
+        return False
+    # skip incidents flagged as false positive in their postmortem
+    if i.false_positive:
+        return False
+    # skip incidents with no component
+    if len(i.components) < 1:
+        return False
+    return True
+
+
+def incident_is_reported(i, start_date, end_date):
+    # reportable, and resolved on a day we are configured to report on
+    if not incident_is_reportable(i):
+        return False
+    resolved_day = from_epoch_ms(i.resolved_at).date()
+    return start_date <= resolved_day <= end_date
+
+
+def group_incidents_by_day(incidents, start_date, end_date):
     incidents_by_day = collections.defaultdict(list)
     for i in incidents:
-        # skip ongoing incidents
-        if i['resolved_at'] is None:
-            continue
-        # skip incidents flagged as false positive in their postmortem
-        if i['postmortem_body'] and 'false positive' in i[
-                'postmortem_body'].lower():
-            continue
-        # skip incidents with no component
-        if len(i["components"]) < 1:
-            continue
-        # skip incidents that aren't for a day we are configured to report on
-        resolved_day = read_statuspage_timestamp(i['resolved_at']).date()
-        if resolved_day < settings.START_DATE or resolved_day > settings.END_DATE:
-            continue
-        # passed all our tests so include in list
-        incidents_by_day[resolved_day].append(i)
+        if incident_is_reported(i, start_date, end_date):
+            incidents_by_day[from_epoch_ms(i.resolved_at).date()].append(i)
     return incidents_by_day
 
 
-def find_downtimes_by_component(components, incidents):
-    downtimes_by_component = {c['name']: [] for c in components}
+def merge_intervals(intervals):
+    # collapse overlapping (start, end) pairs so concurrent incidents on
+    # the same component aren't counted twice
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def split_by_day(start, end):
+    # yield (day, seconds) for each UTC day the interval covers
+    while start < end:
+        day = start.date()
+        midnight = start.replace(hour=0, minute=0, second=0,
+                                 microsecond=0) + timedelta(days=1)
+        clipped = min(end, midnight)
+        yield day, (clipped - start).total_seconds()
+        start = clipped
+
+
+def outage_days(start, end):
+    # the days an incident counts as an outage on; one resolved as soon as
+    # it was opened still counts on that day
+    return [day for day, _ in split_by_day(start, end)] or [start.date()]
+
+
+def find_downtimes_by_day(incidents):
+    # {day: {component name: (seconds down, number of outages)}} for every
+    # day at once: one sorted, merged timeline per component, clipped to
+    # day boundaries, so incidents spanning midnight are charged to each
+    # day they cover
+    intervals_by_component = collections.defaultdict(list)
     for i in incidents:
-        duration = calculate_incident_duration(i)
-        for c in i['components']:
-            downtimes_by_component[c['name']].append(duration)
-    return downtimes_by_component
-
-
-def generate_slo_report(downtimes_by_component, day):
-    rows = []
+        if not incident_is_reportable(i):
+            continue
+        interval = (from_epoch_ms(i.created_at), from_epoch_ms(i.resolved_at))
+        for name, _, _ in i.components:
+            intervals_by_component[name].append(interval)
+
+    downtimes_by_day = collections.defaultdict(dict)
+    for name, intervals in intervals_by_component.items():
+        # outages are counted per incident, downtime from the merged timeline
+        outages = collections.Counter()
+        for start, end in intervals:
+            for day in outage_days(start, end):
+                outages[day] += 1
+        downtimes = collections.Counter()
+        for start, end in merge_intervals(intervals):
+            for day, seconds in split_by_day(start, end):
+                downtimes[day] += seconds
+        for day, num_outages in outages.items():
+            downtimes_by_day[day][name] = (downtimes[day], num_outages)
+    return downtimes_by_day
+
+
+def generate_slo_report(components, downtimes, day):
     day = timestamp_for_hive(day)
-    for name, downtimes in downtimes_by_component.items():
-        total_downtime = sum(downtimes)
+    # one row per component name, in component order
+    for name in dict.fromkeys(c['name'] for c in components):
+        total_downtime, num_outages = downtimes.get(name, (0, 0))
         downtime_percentage = (total_downtime / (24 * 60 * 60)) * 100
         uptime_percentage = 100 - downtime_percentage
-        num_outages = len(downtimes)
-        rows.append({
+        yield {
             'date': day,
             'component': name,
             'uptime': uptime_percentage,
             'num_outages': num_outages
-        })
-    return rows
+        }
 
 
-def generate_incident_report(incidents, groups_by_id, day):
-    rows = []
+def incident_description_for(incident, descriptions, cache):
+    # settled incidents aren't fetched again, so their descriptions are
+    # read from the cache, and only for the days that get written
+    if incident.id in descriptions:
+        return descriptions.get(incident.id)
+    entry = cache.get(DESCRIPTION_KEY % incident.id)
+    return entry.value if entry else None
+
+
+def generate_incident_report(incidents, groups_by_id, day, descriptions,
+                             cache):
     for i in incidents:
-        # get all updates sorted oldest to newest
-        updates = "\t".join([u["body"] for u in i["incident_updates"][::-1]])
-        updates += f'\t{i["postmortem_body"]}'
+        # read back now the day is being written
+        description = incident_description_for(i, descriptions, cache)
 
         # some incidents may have affect multiple components
         # create duplicate records per component in that case
-        for component in i["components"]:
+        for component_name, component_id, group_id in i.components:
             row = {
                 "name":
-                i["name"],
+                i.name,
                 "id":
-                i["id"],
+                i.id,
                 "created_at":
-                timestamp_for_hive(read_statuspage_timestamp(i["created_at"])),
+                timestamp_for_hive(from_epoch_ms(i.created_at)),
                 "resolved_at":
-                timestamp_for_hive(read_statuspage_timestamp(
-                    i["resolved_at"])),
+                timestamp_for_hive(from_epoch_ms(i.resolved_at)),
                 "duration":
                 calculate_incident_duration(i),
                 "component_name":
-                component["name"],
+                component_name,
                 "component_id":
-                component["id"],
+                component_id,
                 "group_name":
-                groups_by_id[component["group_id"]],
+                groups_by_id[group_id],
                 "group_id":
-                component["group_id"],
+                group_id,
                 "impact":
-                i["impact"],
+                i.impact,
                 "description":
-                updates,
+                description,
             }
-            rows.append(row)
-    return rows
+            yield row
+
 
+def load_manifest(uploader):
+    body = uploader.read_object(settings.MANIFEST_KEY)
+    if body is None:
+        return {'components': None, 'incidents': {}, 'days': {}}
+    return json.loads(body)
 
-def write_report(rows, output_path):
-    with open(output_path, 'w') as f:
-        for row in rows:
-            # JSON SerDe wants one object per line
-            f.write("%s\n" % json.dumps(row))
 
+def save_manifest(uploader, manifest):
+    uploader.write_object(settings.MANIFEST_KEY,
+                          json.dumps(manifest, sort_keys=True))
 
-def upload_report(output_path, prefix, display_day):
-    s3_name = "%s/%s.json" % (prefix, display_day)
-    if settings.DRY_RUN:
-        print("would upload %s to %s" % (output_path, s3_name))
+
+def incident_days(incidents):
+    # the first and last day an incident is charged to, keyed by id, along
+    # with the updated_at we saw it at; ongoing incidents aren't charged
+    days = {}
+    for i in incidents:
+        first = last = None
+        if i.resolved_at is not None:
+            first = from_epoch_ms(i.created_at).date().isoformat()
+            last = from_epoch_ms(i.resolved_at).date().isoformat()
+        days[i.id] = [i.updated_at, first, last]
+    return days
+
+
+def days_between(first, last):
+    day = datetime.strptime(first, '%Y-%m-%d').date()
+    last = datetime.strptime(last, '%Y-%m-%d').date()
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def components_hash(components):
+    # every slo file lists every component (and incident rows carry group
+    # names), so any change there means every day needs regenerating
+    fields = sorted([c['id'], c['name'], c['group_id'] or '', c['group']]
+                    for c in components)
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+def find_dirty_days(manifest, components, incidents):
+    if manifest['components'] != components_hash(components):
+        return None
+    dirty = set()
+    seen = incident_days(incidents)
+    previous = manifest['incidents']
+    # new, edited or deleted incidents dirty both their old and new days
+    # (older manifests hold [updated_at, resolved day] pairs, and
+    # updated_at as a timestamp string rather than epoch milliseconds)
+    for incident_id, state in previous.items():
+        if isinstance(state[0], str):
+            previous[incident_id] = [epoch_ms(state[0])] + state[1:]
+    for incident_id in set(seen) | set(previous):
+        if seen.get(incident_id) != previous.get(incident_id):
+            for state in (seen.get(incident_id), previous.get(incident_id)):
+                if state and state[-1]:
+                    dirty.update(days_between(state[1], state[-1]))
+    return dirty
+
+
+def file_hash(output_path):
+    with open(output_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_report(rows, output_path, columns):
+    # returns the number of rows written and the hash of the file
+    if settings.OUTPUT_FORMAT == 'parquet':
+        rows = list(rows)
+        write_parquet(rows, output_path, columns)
+        return len(rows), file_hash(output_path)
+    # JSON SerDe wants one object per line
+    with JSONLinesWriter(output_path) as writer:
+        writer.writerows(rows)
+    return writer.rows, writer.sha256()
+
+
+def upload_report(uploader, output_path, prefix, display_day):
+    if settings.OUTPUT_FORMAT == 'parquet':
+        s3_name = partition_key('%s_parquet/' % prefix, display_day,
+                                '%s.parquet' % display_day)
+    else:
+        s3_name = "%s/%s.json" % (prefix, display_day)
+    uploader.submit(output_path, s3_name)
+
+
+def run_report(event, uploader, cache, checkpoint, deadline, descriptions,
+               start_date, end_date):
+    # a resumed run reuses the components and incidents the job started
+    # with, so its dirty days and manifest agree with the days already done
+    state = checkpoint.state
+    if 'incidents' not in state:
+        with metrics.stage('get_components'):
+            state['components'] = get_components(cache)
+        with metrics.stage('get_incidents'):
+            incidents = get_incidents(cache, descriptions, start_date,
+                                      end_date)
+        state['incidents'] = [i.to_state() for i in incidents]
     else:
-        s3 = boto3.client('s3')
-        s3.upload_file(output_path, settings.S3_BUCKET, s3_name)
+        incidents = [Incident.from_state(i) for i in state['incidents']]
+        # descriptions are only kept on local disk, which a chained run
+        # may not have; they come back from the cache and the newest pages
+        with metrics.stage('get_incidents'):
+            get_incidents(cache, descriptions, start_date, end_date)
+    components = state['components']
+    done_days = state.setdefault('days', {})
+    with JSONLinesWriter(settings.DUMP_PREFIX + "components.jsonl") as output:
+        output.writerows(components)
+    groups_by_id = find_groups(components)
+    metrics.count('incidents', len(incidents))
+    with metrics.stage('find_downtimes'):
+        incidents_by_day = group_incidents_by_day(incidents, start_date,
+                                                  end_date)
+        downtimes_by_day = find_downtimes_by_day(incidents)
+
+    full_rebuild = not settings.INCREMENTAL or event.get('full_rebuild')
+    manifest = load_manifest(uploader)
+    # None means everything is dirty
+    dirty_days = None if full_rebuild else find_dirty_days(
+        manifest, components, incidents)
+
+    # days count as done for the checkpoint (and go into the rollups)
+    # once their uploads are in
+    uploading = {}
+    uploading_partials = {}
+    last_saved = time.monotonic()
+
+    def commit_rollups():
+        rollups.set_days(uploading_partials)
+        uploading_partials.clear()
+        if settings.ROLLUPS:
+            flush_rollups(rollups, uploader, metrics)
+
+    def commit_days():
+        uploader.wait()
+        commit_rollups()
+        done_days.update(uploading)
+        uploading.clear()
+        checkpoint.save()
+
+    try:
+        for day in timerange_for_report(start_date, end_date):
+            display_day = day.strftime('%Y-%m-%d')
+            if display_day in done_days:
+                manifest['days'][display_day] = done_days[display_day]
+                metrics.count('days_resumed')
+                continue
+            day_state = manifest['days'].get(display_day)
+            if (dirty_days is not None and day_state is not None
+                    and display_day not in dirty_days):
+                metrics.count('days_skipped')
+                continue
+            deadline.check()
+            print('processing %s' % display_day)
+            metrics.count('days_processed')
+            # a file that hashes the same as the one uploaded last time
+            # isn't uploaded again, unless everything is being rebuilt
+            uploaded = {} if full_rebuild else day_state or {}
+            day_state = {}
+
+            # rows are generated as they're written
+            partials = {display_day: rollups.new_partials()}
+            rows = generate_slo_report(components,
+                                       downtimes_by_day[day], day)
+            rows = rollups.observe(rows, partials, lambda row: display_day)
+            output_path = '/tmp/slo_%s.%s' % (display_day,
+                                              settings.OUTPUT_FORMAT)
+            with metrics.stage('generate_and_write'):
+                count, day_state['slo'] = write_report(rows, output_path,
+                                                       SLO_COLUMNS)
+            metrics.count('rows', count)
+            if day_state['slo'] != uploaded.get('slo'):
+                upload_report(uploader, output_path, 'slo', display_day)
+            else:
+                metrics.count('files_unchanged')
+
+            rows = generate_incident_report(incidents_by_day[day],
+                                            groups_by_id, day,
+                                            descriptions, cache)
+            output_path = '/tmp/incident_%s.%s' % (display_day,
+                                                   settings.OUTPUT_FORMAT)
+            with metrics.stage('generate_and_write'):
+                count, digest = write_report(rows, output_path,
+                                             INCIDENT_COLUMNS)
+            metrics.count('rows', count)
+            if count:
+                day_state['statuspage_incidents'] = digest
+                if digest != uploaded.get('statuspage_incidents'):
+                    upload_report(uploader, output_path,
+                                  'statuspage_incidents', display_day)
+                else:
+                    metrics.count('files_unchanged')
+            manifest['days'][display_day] = day_state
+            uploading[display_day] = day_state
+            uploading_partials.update(partials)
+            if time.monotonic() - last_saved >= settings.CHECKPOINT_INTERVAL:
+                commit_days()
+                last_saved = time.monotonic()
+    except OutOfTime:
+        # keep whatever made it to S3 for the chained run; after any other
+        # failure the checkpoint holds the days committed so far
+        commit_days()
+        raise
+
+    # only record progress once every upload has gone through;
+    # uploads overlap generation, so this is only the time left waiting
+    with metrics.stage('upload_wait'):
+        uploader.wait()
+    commit_rollups()
+    metrics.count('files_uploaded', len(uploader.uploaded))
+    metrics.count('files_unchanged', len(uploader.skipped))
+    manifest['components'] = components_hash(components)
+    manifest['incidents'] = incident_days(incidents)
+    save_manifest(uploader, manifest)
 
 
 def lambda_handler(event, context):
-    components = get_components()
-    with open("components.json", "w") as output:
-        output.write(json.dumps(components))
-    groups_by_id = find_groups(components)
-    incidents = get_incidents()
-    with open("incidents.json", "w") as output:
-        output.write(json.dumps(incidents))
-    sys.exit(0)
-    incidents_by_day = group_incidents_by_day(incidents)
-
-    for day in timerange_for_report():
-        display_day = day.strftime('%Y-%m-%d')
-        print('processing %s' % display_day)
-
-        downtimes_by_component = find_downtimes_by_component(
-            components, incidents_by_day[day])
-        rows = generate_slo_report(downtimes_by_component, day)
-        output_path = '/tmp/slo_%s.json' % display_day
-        write_report(rows, output_path)
-        upload_report(output_path, 'slo', display_day)
-
-        rows = generate_incident_report(incidents_by_day[day], groups_by_id,
-                                        day)
-        output_path = '/tmp/incident_%s.json' % display_day
-        if rows:
-            write_report(rows, output_path)
-            upload_report(output_path, 'statuspage_incidents', display_day)
+    # event may hold {'full_rebuild': true} and/or {'profile': path}
+    event = event or {}
+    start_date, end_date = report_dates()
+    # one uploader (and S3 client) for everything the run reads and writes;
+    # uploads run in the background while later days are generated
+    with S3Uploader(settings.S3_BUCKET, max_workers=settings.UPLOAD_WORKERS,
+                    dry_run=settings.DRY_RUN) as uploader:
+        checkpoint = open_report_checkpoint(settings, {
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            'full_rebuild': bool(event.get('full_rebuild')),
+        }, uploader)
+        cache = open_report_cache(settings, uploader)
+        deadline = Deadline(context, settings.CHAIN_MARGIN_SECONDS)
+        try:
+            with profiled(event.get('profile') or settings.PROFILE_PATH), \
+                    metrics.stage('total'):
+                with resumable(checkpoint, event, context,
+                               settings.MAX_CHAINED_RUNS), \
+                        TextStore(settings.DESCRIPTIONS_PATH) as descriptions:
+                    run_report(event, uploader, cache, checkpoint, deadline,
+                               descriptions, start_date, end_date)
+        finally:
+            cache.close()
+            metrics.flush(settings.METRICS_OUTPUT, settings.METRICS_NAMESPACE,
+                          {'Report': 'slo'})
 
 
 if __name__ == '__main__':
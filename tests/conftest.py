@@ -0,0 +1,65 @@
+# The reports are scripts that each import their own settings.py, so they're
+# loaded here with that module swapped in, the way combined_report.py does.
+# S3 is a local directory (bench/replay.py's LocalS3Client).
+
+import functools
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'common'), os.path.join(ROOT, 'bench')]
+
+os.environ.update({
+    'API_KEY': 'test',
+    'S3_BUCKET': 'test',
+    'CACHE_BACKEND': '',
+    'CHECKPOINT_BACKEND': '',
+    'METRICS_OUTPUT': '',
+})
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@functools.lru_cache(maxsize=None)
+def load_report(name):
+    report_dir = os.path.join(ROOT, name)
+    report_settings = load_module('%s_settings' % name, os.path.join(report_dir, 'settings.py'))
+    previous = sys.modules.get('settings')
+    sys.modules['settings'] = report_settings
+    try:
+        return load_module('%s_report' % name, os.path.join(report_dir, '%s_report.py' % name))
+    finally:
+        if previous is None:
+            del sys.modules['settings']
+        else:
+            sys.modules['settings'] = previous
+
+
+@pytest.fixture
+def pingdom_report():
+    return load_report('pingdom')
+
+
+@pytest.fixture
+def incident_report():
+    return load_report('incident')
+
+
+@pytest.fixture
+def slo_report():
+    return load_report('slo')
+
+
+@pytest.fixture
+def s3_client(tmp_path):
+    from replay import LocalS3Client
+    return LocalS3Client(str(tmp_path / 's3'))
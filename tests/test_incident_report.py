@@ -0,0 +1,202 @@
+import random
+
+import pytest
+
+
+def log(entry_type, created_at, user=None):
+    entry = {'type': entry_type, 'created_at': created_at}
+    if entry_type == 'acknowledge_log_entry':
+        entry['agent'] = {'summary': user}
+    elif entry_type == 'notify_log_entry':
+        entry['user'] = {'summary': user}
+    return entry
+
+
+def test_log_entry_index_counts_unique_users_across_pages(incident_report):
+    # most recent first, as the api returns them
+    index = incident_report.LogEntryIndex()
+    index.add_all([
+        log('resolve_log_entry', '2026-03-01T10:30:00Z'),
+        log('notify_log_entry', '2026-03-01T10:10:00Z', 'bob'),
+        log('acknowledge_log_entry', '2026-03-01T10:05:00Z', 'alice'),
+    ])
+    index.add_all([
+        log('notify_log_entry', '2026-03-01T10:01:00Z', 'alice'),
+        log('notify_log_entry', '2026-03-01T10:00:00Z', 'bob'),
+        log('trigger_log_entry', '2026-03-01T10:00:00Z'),
+    ])
+    assert index.num_users_notified == 2
+    assert index.user_credited == 'alice'
+    assert incident_report.first_timestamp_for_type(index, 'notify_log_entry').isoformat() == \
+        '2026-03-01T10:00:00+00:00'
+
+    restored = incident_report.LogEntryIndex.from_state(index.to_state())
+    assert restored.num_users_notified == 2
+    assert restored.user_credited == 'alice'
+
+
+def test_big_batches_fall_back_to_per_incident_rows(incident_report, monkeypatch):
+    # without numpy/pandas in the bundle the rows are the same, and counted
+    from pytz import utc
+
+    incident = incident_report.Incident('P1', 'Disk full', 'high', 'Ops', 'web', 1772359200000, 'resolved')
+    index = incident_report.LogEntryIndex()
+    index.add_all([
+        log('resolve_log_entry', '2026-03-01T10:30:00Z'),
+        log('notify_log_entry', '2026-03-01T10:00:00Z', 'bob'),
+    ])
+    monkeypatch.setattr(incident_report.settings, 'BATCH_THRESHOLD', 1)
+    monkeypatch.setattr(incident_report, 'batch_modules_installed', lambda: False)
+    monkeypatch.setattr(incident_report, 'metrics', incident_report.Metrics())
+
+    rows = list(incident_report.generate_rows([incident], {'P1': index}, {'bob': utc}))
+    assert [(row['user'], row['time_to_resolve']) for row in rows] == [('bob', 1800)]
+    assert incident_report.metrics.values['batch_fallbacks'] == 1
+
+
+def test_rows_outside_the_window_are_left_out(incident_report):
+    # an incident created at the window's end comes back from the api too
+    partials = {'2026-03-01': incident_report.rollups.new_partials()}
+    rows = [{'created_at': '2026-03-01 23:59:59', 'service': 'web', 'escalation_policy': 'Ops',
+             'user': 'bob', 'time_to_acknowledge': 60, 'time_to_resolve': 600, 'out_of_hours': True},
+            {'created_at': '2026-03-02 00:00:00', 'service': 'web', 'escalation_policy': 'Ops',
+             'user': 'bob', 'time_to_acknowledge': 60, 'time_to_resolve': 600, 'out_of_hours': False}]
+    observed = incident_report.rollups.observe(incident_report.rows_in_window(rows, partials), partials,
+                                               lambda row: row['created_at'][:10])
+    assert [row['created_at'] for row in observed] == ['2026-03-01 23:59:59']
+
+
+def test_backfill_days_share_log_entry_fetches(incident_report, monkeypatch):
+    # each day's grace days are the next shards' own days; none is fetched twice
+    fetched = []
+
+    def fetch_log_entry_day(day):
+        fetched.append(day)
+        index = incident_report.LogEntryIndex()
+        index.add(log('notify_log_entry', '%sT12:00:00Z' % day, 'bob-%s' % day))
+        return {'P1': index}
+
+    monkeypatch.setattr(incident_report, 'fetch_log_entry_day', fetch_log_entry_day)
+    monkeypatch.setattr(incident_report.settings, 'LOG_ENTRY_GRACE_DAYS', 2)
+    log_days = incident_report.LogEntryDays(4)
+    incidents = [incident_report.Incident('P1', 'Disk full', 'high', 'Ops', 'web', 1772359200000, 'triggered')]
+    for since, until in incident_report.backfill_shards('2026-03-01', '2026-03-04'):
+        indexes = incident_report.fetch_log_entry_indexes(log_days, incidents, since, until)
+    assert fetched == ['2026-03-03', '2026-03-02', '2026-03-01', '2026-03-04', '2026-03-05']
+    # the last shard's entries, most recent day first
+    assert indexes['P1'].users_notified == ['bob-2026-03-05', 'bob-2026-03-04', 'bob-2026-03-03']
+    assert indexes['P1'].user_credited == 'bob-2026-03-03'
+
+
+def test_queries_past_the_pagination_limit_fail(incident_report, monkeypatch):
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'log_entries': [{}] * incident_report.PAGE_LIMIT, 'more': True}
+
+    class Session:
+        def get(self, url, params):
+            return Response()
+
+    monkeypatch.setattr(incident_report, 'get_session', Session)
+    monkeypatch.setattr(incident_report.settings, 'MAX_PAGINATION_OFFSET', 300)
+    pages = incident_report.find_pages('log_entries', 'log_entries', since='2026-03-01')
+    assert len(next(pages)) == incident_report.PAGE_LIMIT
+    next(pages)
+    next(pages)
+    with pytest.raises(RuntimeError):
+        next(pages)
+
+
+def test_batched_rows_match_per_incident_rows(incident_report, monkeypatch):
+    pytest.importorskip('numpy')
+    pytest.importorskip('pandas')
+    from pytz import timezone
+
+    # a year of incidents, so every timezone's DST changes are crossed, with
+    # millisecond times that round both ways and some never acked or resolved
+    zones = ['UTC', 'America/New_York', 'Europe/London', 'Asia/Kolkata', 'Australia/Sydney']
+    timezones = {'user-%d' % n: timezone(zone) for n, zone in enumerate(zones)}
+    users = sorted(timezones)
+    rng = random.Random(5)
+    incidents = []
+    indexes = {}
+    for n in range(500):
+        created_at = 1767225600000 + rng.randrange(365 * 86400 * 1000)
+        incident = incident_report.Incident('P%d' % n, 'Incident %d' % n, 'high', 'Ops', 'web',
+                                            created_at, 'resolved')
+        first_at = {'notify_log_entry': created_at}
+        notified = rng.sample(users, rng.randint(1, 3))
+        acked = []
+        if rng.random() < 0.8:
+            first_at['acknowledge_log_entry'] = created_at + rng.randrange(3600 * 1000)
+            acked = rng.sample(users, rng.randint(1, 2))
+        if rng.random() < 0.8:
+            first_at['resolve_log_entry'] = created_at + rng.randrange(86400 * 1000)
+        incidents.append(incident)
+        indexes[incident.id] = (first_at, acked, notified)
+
+    def rows(threshold):
+        monkeypatch.setattr(incident_report.settings, 'BATCH_THRESHOLD', threshold)
+        indexes_by_incident = {incident_id: incident_report.LogEntryIndex(dict(first_at), list(acked),
+                                                                          list(notified))
+                               for incident_id, (first_at, acked, notified) in indexes.items()}
+        return list(incident_report.generate_rows(incidents, indexes_by_incident, timezones))
+
+    batched = rows(1)
+    scalar = rows(len(incidents) + 1)
+    assert batched == scalar
+    assert {row['out_of_hours'] for row in scalar} == {True, False}
+    assert any(row['time_to_acknowledge'] is None for row in scalar)
+    assert any(row['time_to_resolve'] is None for row in scalar)
+
+
+def test_excluded_services_and_low_urgency_are_left_out_of_the_query(incident_report, monkeypatch):
+    from response_cache import NullBackend, ResponseCache
+
+    services = [{'id': 'S1', 'name': 'Checkout'}, {'id': 'S2', 'name': 'Out of hours'},
+                {'id': 'S3', 'name': 'Search'}]
+    incident = {'id': 'P1', 'title': 'Disk full', 'urgency': 'high', 'escalation_policy': {'summary': 'Ops'},
+                'service': {'summary': 'Search'}, 'created_at': '2026-03-01T10:00:00Z', 'status': 'resolved'}
+    queries = []
+
+    class Response:
+        def __init__(self, body):
+            self.body = body
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return self.body
+
+    class Session:
+        def get(self, url, params):
+            queries.append((url.rsplit('/', 1)[1], params))
+            if url.endswith('/services'):
+                return Response({'services': services, 'more': False})
+            return Response({'incidents': [incident], 'more': False})
+
+    monkeypatch.setattr(incident_report, 'get_session', Session)
+    monkeypatch.setattr(incident_report, 'metrics', incident_report.Metrics())
+    monkeypatch.setattr(incident_report.settings, 'EXCLUDE_LOW_URGENCY', True)
+    cache = ResponseCache(NullBackend())
+
+    incidents = incident_report.get_incidents(cache, '2026-03-01', '2026-03-02')
+    assert [i.id for i in incidents] == ['P1']
+    name, params = queries[-1]
+    assert name == 'incidents'
+    assert params['service_ids[]'] == ['S1', 'S3']
+    assert params['urgencies[]'] == ['high']
+
+    # too many services to list in the query: they're filtered afterwards
+    monkeypatch.setattr(incident_report.settings, 'MAX_SERVICE_IDS_PER_QUERY', 1)
+    assert incident_report.incident_filters(cache, '2026-03-02') == {'urgencies': ['high']}
+
+    # and with every service excluded, there's nothing to ask for
+    services[:] = [{'id': 'S2', 'name': 'Out of hours'}]
+    queries.clear()
+    assert incident_report.get_incidents(cache, '2026-03-01', '2026-03-02') == []
+    assert [name for name, _ in queries] == ['services']
@@ -0,0 +1,320 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+import csv
+import functools
+import io
+import json
+
+import pytest
+
+from uploader import S3Uploader
+
+
+def test_warm_runs_fetch_up_to_their_own_start(pingdom_report, s3_client, tmp_path, monkeypatch):
+    # a warm lambda runs main() again in the same process, with settings
+    # already imported; each run has to fetch up to its own start time
+    report = pingdom_report
+    now = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+    check = {"id": 1, "name": "web", "tags": [], "status": "up", "lasterrortime": 100}
+    fetched = []
+
+    async def get_checks(fetcher, cache, ttl=None):
+        return [dict(check)]
+
+    async def get_outages(fetcher, check_id, from_, to_):
+        fetched.append((from_, to_))
+        return [{"status": "down", "timefrom": from_, "timeto": to_}]
+
+    monkeypatch.setattr(report, "get_checks", get_checks)
+    monkeypatch.setattr(report, "get_outages", get_outages)
+    monkeypatch.setattr(report, "utcnow", lambda: now)
+    monkeypatch.setattr(report, "S3Uploader", functools.partial(S3Uploader, client=s3_client))
+    monkeypatch.setattr(report.settings, "INCREMENTAL", True)
+    monkeypatch.setattr(report.settings, "OUTPUT_PATH", str(tmp_path / "out") + "/")
+
+    asyncio.run(report.main())
+    first_run = int(now.timestamp())
+    now += timedelta(minutes=15)
+    check["lasterrortime"] = first_run + 60
+    asyncio.run(report.main())
+
+    start = int(datetime(2026, 10, 16, tzinfo=timezone.utc).timestamp())
+    assert fetched == [(start, first_run), (first_run, int(now.timestamp()))]
+    cursor = json.loads(s3_client.get_object(Bucket="test", Key=report.settings.CURSOR_KEY)["Body"].read())
+    assert cursor["1"]["timeto"] == int(now.timestamp())
+
+
+def test_resumed_run_replays_checkpointed_checks(pingdom_report, s3_client, tmp_path, monkeypatch):
+    # a full run that fails part way keeps the checks it finished in
+    # checkpoint parts, and the next run only fetches the rest
+    report = pingdom_report
+    now = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+    checks = [{"id": n, "name": "web%d" % n, "tags": [], "status": "up"} for n in (1, 2, 3)]
+    fetched = []
+    failing = {3}
+
+    async def get_checks(fetcher, cache, ttl=None):
+        return [dict(c) for c in checks]
+
+    async def get_outages(fetcher, check_id, from_, to_):
+        if check_id in failing:
+            raise RuntimeError("api down")
+        fetched.append(check_id)
+        return [{"status": "down", "timefrom": from_ + check_id, "timeto": to_}]
+
+    monkeypatch.setattr(report, "get_checks", get_checks)
+    monkeypatch.setattr(report, "get_outages", get_outages)
+    monkeypatch.setattr(report, "utcnow", lambda: now)
+    monkeypatch.setattr(report, "S3Uploader", functools.partial(S3Uploader, client=s3_client))
+    monkeypatch.setattr(report.settings, "INCREMENTAL", False)
+    monkeypatch.setattr(report.settings, "CONCURRENCY", 1)
+    monkeypatch.setattr(report.settings, "CHECKPOINT_BACKEND", "s3")
+    monkeypatch.setattr(report.settings, "CHECKPOINT_INTERVAL", 0)
+    monkeypatch.setattr(report.settings, "OUTPUT_PATH", str(tmp_path / "out") + "/")
+    key = report.settings.CHECKPOINT_KEY
+
+    try:
+        asyncio.run(report.main())
+    except RuntimeError:
+        pass
+    saved = json.loads(s3_client.get_object(Bucket="test", Key=key)["Body"].read())
+    assert saved["state"]["checks_done"] == ["1", "2"]
+    assert saved["state"]["parts"] == 2
+
+    failing.clear()
+    asyncio.run(report.main())
+    assert fetched == [1, 2, 3]
+    body = s3_client.get_object(Bucket="test", Key="pingdom_outages/2026-10-16.csv")["Body"].read()
+    rows = list(csv.DictReader(io.StringIO(body.decode())))
+    assert sorted(row["check_id"] for row in rows) == ["1", "2", "3"]
+    assert not s3_client.objects("manifests/pingdom_checkpoint")
+
+
+def test_incremental_rows_are_merged_with_the_uploaded_day(pingdom_report, s3_client, monkeypatch):
+    # new rows go straight through; the uploaded ones they don't replace follow
+    report = pingdom_report
+    monkeypatch.setattr(report.settings, "OUTPUT_FORMAT", "csv")
+    monkeypatch.setattr(report.settings, "OUTPUT_COMPRESSION", None)
+    uploaded = "check_id,service,timefrom,timeto,status,tags\r\n1,web,100,200,up,\r\n2,api,100,150,down,\r\n"
+    s3_client.put_object(Bucket="test", Key="pingdom_outages/1970-01-01.csv", Body=uploaded.encode())
+    new = [{"check_id": 2, "service": "api", "timefrom": 100, "timeto": 300, "status": "down", "tags": ""},
+           {"check_id": 3, "service": "db", "timefrom": 120, "timeto": 130, "status": "down", "tags": ""}]
+
+    async def rows():
+        for row in new:
+            yield "1970-01-01", row
+
+    async def merge(s3, stale_keys):
+        return [row async for row in report.merge_with_uploaded(rows(), stale_keys, s3)]
+
+    stale_keys = []
+    with S3Uploader("test", client=s3_client) as s3:
+        merged = asyncio.run(merge(s3, stale_keys))
+    assert [(row["check_id"], row["timeto"]) for _, row in merged] == [(2, 300), (3, 130), (1, 200)]
+    assert stale_keys == ["pingdom_outages/1970-01-01.csv"]
+
+
+
+def day_timestamp(day, hour=0):
+    return int(datetime.strptime(day, "%Y-%m-%d").replace(hour=hour, tzinfo=timezone.utc).timestamp())
+
+
+def read_day(s3_client, day):
+    body = s3_client.get_object(Bucket="test", Key="pingdom_outages/%s.csv" % day)["Body"].read()
+    return sorted((int(row["check_id"]), int(row["timefrom"]), int(row["timeto"]), row["status"])
+                  for row in csv.DictReader(io.StringIO(body.decode())))
+
+
+def run_backfill(report, s3_client, tmp_path, monkeypatch, states, start, end, clip):
+    # states: check id -> its (status, timefrom, timeto) states, which come
+    # back from any window they overlap, clipped to it when clip is set
+    checks = [{"id": check_id, "name": "web%d" % check_id, "tags": [], "status": "up"} for check_id in states]
+
+    async def get_checks(fetcher, cache, ttl=None):
+        return [dict(c) for c in checks]
+
+    async def get_outages(fetcher, check_id, from_, to_):
+        return [{"status": status,
+                 "timefrom": max(timefrom, from_) if clip else timefrom,
+                 "timeto": min(timeto, to_) if clip else timeto}
+                for status, timefrom, timeto in states[check_id] if timeto > from_ and timefrom < to_]
+
+    monkeypatch.setattr(report, "get_checks", get_checks)
+    monkeypatch.setattr(report, "get_outages", get_outages)
+    monkeypatch.setattr(report, "S3Uploader", functools.partial(S3Uploader, client=s3_client))
+    monkeypatch.setattr(report.settings, "OUTPUT_FORMAT", "csv")
+    monkeypatch.setattr(report.settings, "OUTPUT_COMPRESSION", None)
+    monkeypatch.setattr(report.settings, "OUTPUT_PATH", str(tmp_path / "out") + "/")
+    asyncio.run(report.main({"backfill": {"start": start, "end": end}}))
+
+
+def test_backfill_merges_states_started_before_it_with_the_uploaded_day(
+    pingdom_report, s3_client, tmp_path, monkeypatch
+):
+    # a state going on when the backfill starts is dated the day before,
+    # whose uploaded rows are kept
+    uploaded = "check_id,service,timefrom,timeto,status,tags\r\n2,api,%d,%d,down,\r\n" % (
+        day_timestamp("2026-10-09", 1), day_timestamp("2026-10-09", 2))
+    s3_client.put_object(Bucket="test", Key="pingdom_outages/2026-10-09.csv", Body=uploaded.encode())
+    states = {1: [("up", day_timestamp("2026-10-09", 6), day_timestamp("2026-10-11")),
+                  ("down", day_timestamp("2026-10-11"), day_timestamp("2026-10-12"))]}
+    run_backfill(pingdom_report, s3_client, tmp_path, monkeypatch, states, "2026-10-10", "2026-10-12", clip=False)
+
+    assert read_day(s3_client, "2026-10-09") == [
+        (1, day_timestamp("2026-10-09", 6), day_timestamp("2026-10-11"), "up"),
+        (2, day_timestamp("2026-10-09", 1), day_timestamp("2026-10-09", 2), "down"),
+    ]
+    assert read_day(s3_client, "2026-10-11") == [
+        (1, day_timestamp("2026-10-11"), day_timestamp("2026-10-12"), "down")]
+
+
+@pytest.mark.parametrize("clip", [True, False])
+def test_backfill_stitches_states_across_chunks(pingdom_report, s3_client, tmp_path, monkeypatch, clip):
+    # a state crossing from one chunk into the next is written once, whole,
+    # on the day it started
+    monkeypatch.setattr(pingdom_report.settings, "BACKFILL_CHUNK_DAYS", 1)
+    monkeypatch.setattr(pingdom_report.settings, "OUTAGE_WINDOW_DAYS", 1)
+    states = {1: [("up", day_timestamp("2026-10-10"), day_timestamp("2026-10-12", 12)),
+                  ("down", day_timestamp("2026-10-12", 12), day_timestamp("2026-10-13"))]}
+    run_backfill(pingdom_report, s3_client, tmp_path, monkeypatch, states, "2026-10-10", "2026-10-13", clip)
+
+    assert read_day(s3_client, "2026-10-10") == [
+        (1, day_timestamp("2026-10-10"), day_timestamp("2026-10-12", 12), "up")]
+    assert not s3_client.objects("pingdom_outages/2026-10-11")
+    assert read_day(s3_client, "2026-10-12") == [
+        (1, day_timestamp("2026-10-12", 12), day_timestamp("2026-10-13"), "down")]
+
+
+def test_outage_windows_stitch_states_crossing_them(pingdom_report, monkeypatch):
+    # each window returns its own piece of a state crossing it; the pieces
+    # come back as one state, and states inside a window come back as is
+    report = pingdom_report
+    states = {1: [("up", 0, 50), ("down", 50, 250), ("up", 250, 300)],
+              2: [("down", 120, 130)]}
+
+    async def get_outages(fetcher, check_id, from_, to_):
+        return [{"status": status, "timefrom": max(timefrom, from_), "timeto": min(timeto, to_)}
+                for status, timefrom, timeto in states[check_id] if timefrom < to_ and timeto > from_]
+
+    monkeypatch.setattr(report, "get_outages", get_outages)
+    checks = [{"id": 1}, {"id": 2}]
+    windows = [(0, 100), (100, 200), (200, 300)]
+    carried = {}
+
+    async def fetch():
+        fetched = {}
+        async for check, found in report.fetch_outage_windows(None, checks, windows, carried):
+            fetched.setdefault(check["id"], []).extend(found)
+        return fetched
+
+    fetched = asyncio.run(fetch())
+    assert sorted((s["timefrom"], s["timeto"], s["status"]) for s in fetched[1]) == [
+        (timefrom, timeto, status) for status, timefrom, timeto in states[1]]
+    assert [(s["status"], s["timefrom"], s["timeto"]) for s in fetched[2]] == states[2]
+    # the state still going at the end of the windows is kept for the next chunk
+    assert carried == {"1": {"status": "up", "timefrom": 250, "timeto": 300}}
+
+
+class FakeResponse:
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def read(self):
+        return json.dumps(self.body).encode()
+
+    def raise_for_status(self):
+        raise RuntimeError("HTTP %d" % self.status)
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, headers=None):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def test_fetcher_retries_with_jittered_backoff(pingdom_report, monkeypatch):
+    # 429s and 5xx are retried, waiting a random time up to the capped
+    # exponential backoff, or Retry-After plus some jitter when it's given
+    report = pingdom_report
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(report.asyncio, "sleep", record_sleep)
+    monkeypatch.setattr(report.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(report.settings, "BACKOFF_BASE", 1)
+    monkeypatch.setattr(report.settings, "BACKOFF_MAX", 3)
+    session = FakeSession([
+        FakeResponse(503),
+        FakeResponse(500),
+        FakeResponse(502),
+        FakeResponse(429, headers={"Retry-After": "7"}),
+        FakeResponse(200, {"ok": True}),
+    ])
+
+    async def fetch():
+        limiter = report.RateLimiter(1000, 10)
+        fetcher = report.Fetcher(session, 2, limiter, max_retries=4)
+        return await fetcher.get_json("https://api.example/checks")
+
+    assert asyncio.run(fetch()) == {"ok": True}
+    assert session.calls == 5
+    assert delays == [1, 2, 3, 8]
+
+
+def test_fetcher_gives_up_after_max_retries(pingdom_report, monkeypatch):
+    report = pingdom_report
+
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(report.asyncio, "sleep", no_sleep)
+    session = FakeSession([FakeResponse(503) for _ in range(3)] + [FakeResponse(404)])
+
+    async def fetch():
+        fetcher = report.Fetcher(session, 2, report.RateLimiter(1000, 10), max_retries=2)
+        return await fetcher.get_json("https://api.example/checks")
+
+    with pytest.raises(RuntimeError, match="503"):
+        asyncio.run(fetch())
+    assert session.calls == 3
+
+    # other errors aren't retried at all
+    session = FakeSession([FakeResponse(404)])
+    with pytest.raises(RuntimeError, match="404"):
+        asyncio.run(fetch())
+    assert session.calls == 1
+
+
+def test_rate_limiter_follows_the_tighter_pingdom_limit(pingdom_report, monkeypatch):
+    report = pingdom_report
+    monkeypatch.setattr(report.settings, "MIN_REQUEST_RATE", 0.1)
+
+    async def update():
+        limiter = report.RateLimiter(100, 50)
+        limiter.update_from_headers({
+            "Req-Limit-Short": "Remaining: 30 Time until reset: 60",
+            "Req-Limit-Long": "Remaining: 600 Time until reset: 3600",
+        })
+        return limiter
+
+    limiter = asyncio.run(update())
+    # 600 requests over the next hour is the lower sustained rate
+    assert limiter.rate == pytest.approx(600 / 3600)
+    # and no more than the short window has left can go at once
+    assert limiter.tokens <= 30
@@ -0,0 +1,51 @@
+import json
+
+from rollups import Rollup, Rollups, period_start
+from uploader import S3Uploader
+
+
+def test_period_start():
+    # 2026-03-01 is a sunday
+    assert period_start('2026-03-01', 'weekly') == '2026-02-23'
+    assert period_start('2026-03-02', 'weekly') == '2026-03-02'
+    assert period_start('2026-03-31', 'monthly') == '2026-03-01'
+
+
+def read_rows(s3_client, key):
+    body = s3_client.get_object(Bucket='test', Key=key)['Body'].read().decode()
+    return [json.loads(line) for line in body.splitlines()]
+
+
+def test_days_are_rolled_up_into_their_own_periods(s3_client):
+    rollups = Rollups([
+        Rollup('slo', ['component'], [
+            ('days', 'count', None),
+            ('uptime', 'mean', 'uptime'),
+        ]),
+    ], 'manifests/rollups/')
+
+    def day(uptime):
+        partials = rollups.new_partials()
+        rollups.add(partials, {'component': 'Web', 'uptime': uptime})
+        return partials
+
+    # either side of a week boundary, in the same month
+    with S3Uploader('test', client=s3_client) as uploader:
+        rollups.set_days({'2026-03-01': day(100), '2026-03-02': day(90)})
+        assert rollups.flush(uploader) == 3
+    assert read_rows(s3_client, 'slo_weekly/2026-02-23.json') == [
+        {'period_start': '2026-02-23', 'component': 'Web', 'days': 1, 'uptime': 100}]
+    assert read_rows(s3_client, 'slo_weekly/2026-03-02.json') == [
+        {'period_start': '2026-03-02', 'component': 'Web', 'days': 1, 'uptime': 90}]
+    assert read_rows(s3_client, 'slo_monthly/2026-03-01.json') == [
+        {'period_start': '2026-03-01', 'component': 'Web', 'days': 2, 'uptime': 95}]
+
+    # a regenerated day replaces what it added before, and only its
+    # periods are rewritten
+    with S3Uploader('test', client=s3_client) as uploader:
+        rollups.set_days({'2026-03-02': day(80)})
+        assert rollups.flush(uploader) == 2
+    assert read_rows(s3_client, 'slo_weekly/2026-03-02.json')[0]['uptime'] == 80
+    assert read_rows(s3_client, 'slo_weekly/2026-02-23.json')[0]['uptime'] == 100
+    assert read_rows(s3_client, 'slo_monthly/2026-03-01.json') == [
+        {'period_start': '2026-03-01', 'component': 'Web', 'days': 2, 'uptime': 90}]
@@ -0,0 +1,115 @@
+from datetime import date, datetime, timedelta, timezone
+import functools
+import json
+
+from metrics import Metrics
+from timestamps import epoch_ms
+from uploader import S3Uploader
+
+
+def at(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M').replace(tzinfo=timezone.utc)
+
+
+def incident(slo_report, incident_id, created_at, resolved_at, components=('Web',),
+             updated_at='2026-01-01 00:00'):
+    return slo_report.Incident(
+        incident_id, 'Outage %s' % incident_id, 'minor',
+        epoch_ms(at(created_at).strftime('%Y-%m-%dT%H:%M:%S.000Z')),
+        epoch_ms(at(resolved_at).strftime('%Y-%m-%dT%H:%M:%S.000Z')),
+        epoch_ms(at(updated_at).strftime('%Y-%m-%dT%H:%M:%S.000Z')),
+        tuple((name, 'c-%s' % name, 'g') for name in components), False)
+
+
+def test_merge_intervals(slo_report):
+    assert slo_report.merge_intervals([]) == []
+    assert slo_report.merge_intervals([(5, 7), (1, 3), (2, 4), (4, 5), (9, 10)]) == [[1, 7], [9, 10]]
+    # contained intervals don't extend the one around them
+    assert slo_report.merge_intervals([(1, 10), (2, 3)]) == [[1, 10]]
+
+
+def test_split_by_day(slo_report):
+    assert list(slo_report.split_by_day(at('2026-03-01 10:00'), at('2026-03-01 11:30'))) == [
+        (date(2026, 3, 1), 5400)]
+    assert list(slo_report.split_by_day(at('2026-03-01 23:00'), at('2026-03-03 01:00'))) == [
+        (date(2026, 3, 1), 3600), (date(2026, 3, 2), 86400), (date(2026, 3, 3), 3600)]
+    # ending at midnight doesn't touch the next day
+    assert list(slo_report.split_by_day(at('2026-03-01 23:00'), at('2026-03-02 00:00'))) == [
+        (date(2026, 3, 1), 3600)]
+    assert list(slo_report.split_by_day(at('2026-03-01 10:00'), at('2026-03-01 10:00'))) == []
+
+
+def test_downtimes_are_clipped_to_days_and_merged(slo_report):
+    downtimes = slo_report.find_downtimes_by_day([
+        incident(slo_report, 'a', '2026-03-01 23:00', '2026-03-02 01:00'),
+        # overlaps a, so adds no downtime, but is another outage
+        incident(slo_report, 'b', '2026-03-02 00:30', '2026-03-02 00:45', ('Web', 'Sync')),
+    ])
+    assert downtimes[date(2026, 3, 1)] == {'Web': (3600, 1)}
+    assert downtimes[date(2026, 3, 2)] == {'Web': (3600, 2), 'Sync': (900, 1)}
+
+
+def test_zero_length_incident_counts_as_an_outage(slo_report):
+    downtimes = slo_report.find_downtimes_by_day([
+        incident(slo_report, 'a', '2026-03-01 10:00', '2026-03-01 10:00')])
+    assert downtimes[date(2026, 3, 1)] == {'Web': (0, 1)}
+    rows = list(slo_report.generate_slo_report(
+        [{'name': 'Web'}], downtimes[date(2026, 3, 1)], at('2026-03-01 00:00')))
+    assert rows[0]['num_outages'] == 1
+    assert rows[0]['uptime'] == 100
+
+
+def run_slo_report(report, s3_client, tmp_path, monkeypatch, incidents):
+    # one lambda run against local S3, returning its metrics
+    components = [
+        {'id': 'g', 'name': 'Platform', 'group_id': None, 'group': True},
+        {'id': 'c-Web', 'name': 'Web', 'group_id': 'g', 'group': False},
+    ]
+
+    def get_incidents(cache, descriptions, start_date, end_date):
+        for i in incidents:
+            if report.incident_is_reported(i, start_date, end_date):
+                descriptions.put(i.id, 'Investigating\tResolved\t')
+        return incidents
+
+    monkeypatch.setattr(report, 'get_components', lambda cache: components)
+    monkeypatch.setattr(report, 'get_incidents', get_incidents)
+    monkeypatch.setattr(report, 'S3Uploader', functools.partial(S3Uploader, client=s3_client))
+    monkeypatch.setattr(report, 'metrics', Metrics())
+    monkeypatch.setattr(report.settings, 'DAYS', 120)
+    monkeypatch.setattr(report.settings, 'DESCRIPTIONS_PATH', str(tmp_path / 'descriptions'))
+    monkeypatch.setattr(report.settings, 'DUMP_PREFIX', str(tmp_path / 'raw_'))
+    metrics_path = tmp_path / 'metrics.jsonl'
+    monkeypatch.setattr(report.settings, 'METRICS_OUTPUT', str(metrics_path))
+    report.lambda_handler(None, None)
+    with open(metrics_path) as f:
+        return json.loads(f.readlines()[-1])
+
+
+def test_editing_an_incident_only_reprocesses_its_days(slo_report, s3_client, tmp_path, monkeypatch):
+    today = date.today()
+
+    def outage(incident_id, days_ago, updated_at='2026-01-01 00:00'):
+        start = '%s 10:00' % (today - timedelta(days=days_ago)).isoformat()
+        end = '%s 11:00' % (today - timedelta(days=days_ago)).isoformat()
+        return incident(slo_report, incident_id, start, end, updated_at=updated_at)
+
+    incidents = [outage('a', 10), outage('b', 50), outage('c', 100)]
+    first = run_slo_report(slo_report, s3_client, tmp_path, monkeypatch, incidents)
+    assert first['days_processed'] == 120
+    assert first['files_uploaded'] == 123
+    day = (today - timedelta(days=50)).isoformat()
+    assert s3_client.objects('statuspage_incidents/%s.json' % day)
+
+    # a postmortem edit bumps updated_at, but changes nothing reported
+    incidents[1] = outage('b', 50, updated_at='2026-01-02 00:00')
+    second = run_slo_report(slo_report, s3_client, tmp_path, monkeypatch, incidents)
+    assert second['days_processed'] == 1
+    assert second['days_skipped'] == 119
+    assert second['files_unchanged'] == 2
+    assert second['files_uploaded'] == 0
+
+    # and with nothing changed, no day is
+    third = run_slo_report(slo_report, s3_client, tmp_path, monkeypatch, incidents)
+    assert third.get('days_processed', 0) == 0
+    assert third['days_skipped'] == 120
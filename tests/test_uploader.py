@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from uploader import S3Uploader
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_unchanged_files_are_skipped(s3_client, tmp_path):
+    day = write(tmp_path / 'day.json', b'{"id": 1}\n')
+    with S3Uploader('test', client=s3_client) as uploader:
+        uploader.upload_all([(day, 'report/2026-03-01.json')])
+    assert uploader.uploaded == ['report/2026-03-01.json']
+
+    other = write(tmp_path / 'other.json', b'{"id": 2}\n')
+    with S3Uploader('test', client=s3_client) as uploader:
+        uploader.upload_all([(day, 'report/2026-03-01.json'),
+                             (other, 'report/2026-03-02.json')])
+    assert uploader.skipped == ['report/2026-03-01.json']
+    assert uploader.uploaded == ['report/2026-03-02.json']
+    assert s3_client.put_count == 2
+
+    write(tmp_path / 'day.json', b'{"id": 3}\n')
+    with S3Uploader('test', client=s3_client) as uploader:
+        uploader.upload_all([(day, 'report/2026-03-01.json')])
+    assert uploader.uploaded == ['report/2026-03-01.json']
+    assert s3_client.get_object(Bucket='test', Key='report/2026-03-01.json')['Body'].read() == b'{"id": 3}\n'
+
+
+def test_multipart_upload_joins_parts_in_order(s3_client, tmp_path):
+    with S3Uploader('test', client=s3_client) as uploader:
+        upload = uploader.multipart('report/big.json')
+        assert not upload.started
+        parts = [write(tmp_path / 'part1', b'first\n'), write(tmp_path / 'part2', b'second\n')]
+        for part in parts:
+            upload.add_part(part)
+        assert upload.started
+        upload.complete()
+
+    assert s3_client.get_object(Bucket='test', Key='report/big.json')['Body'].read() == b'first\nsecond\n'
+    assert uploader.uploaded == ['report/big.json']
+    assert not any(os.path.exists(part) for part in parts)
+
+
+def test_failed_multipart_upload_is_aborted(s3_client, tmp_path):
+    with S3Uploader('test', client=s3_client) as uploader:
+        upload = uploader.multipart('report/big.json')
+        upload.add_part(write(tmp_path / 'part1', b'first\n'))
+        upload.add_part(str(tmp_path / 'missing'))
+        with pytest.raises(FileNotFoundError):
+            upload.complete()
+
+    assert not upload.started
+    assert s3_client.objects('report/') == {}
+    assert uploader.uploaded == []